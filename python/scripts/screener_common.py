@@ -0,0 +1,58 @@
+# Helpers shared by screener_top40_fractional.py and screener_crypto_top40_fractional.py
+
+import csv, math
+from pathlib import Path
+
+import pandas as pd
+
+def to_num(x: str | None) -> float | None:
+    """float() of a holdings cell; blank/garbage/nan cells give None (null in the JSON)."""
+    try: v = float(x)
+    except (TypeError, ValueError): return None
+    return v if math.isfinite(v) else None
+
+def read_holdings_rows(path: str, cols: list[str], numeric: tuple[str, ...]) -> list[dict]:
+    """Rows of a holdings CSV as {col: value} for cols (headers matched case-insensitively).
+
+    Text cells are stripped, numeric ones go through to_num. A short row reads its
+    missing cells as blank; a row with no cols[0] (the symbol) is skipped with a
+    warning, and a bad number is kept as None with a warning, so one bad line no
+    longer drops the whole file. A missing column ignores the file, as before.
+    """
+    out = []
+    # a handful of rows: csv is cheaper than building a DataFrame to iterrows() it
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rd = csv.DictReader(f)
+        names = {c.lower(): c for c in rd.fieldnames or []}
+        if not all(c in names for c in cols):
+            print(f"WARNING: {path} missing required columns ({','.join(cols)}); ignoring holdings.")
+            return out
+        for line, r in enumerate(rd, start=2):
+            row = {}
+            for c in cols:
+                cell = (r[names[c]] or "").strip()
+                if c in numeric:
+                    row[c] = to_num(cell)
+                    if row[c] is None:
+                        print(f"WARNING: {path} line {line}: bad {c} {cell!r}; left empty.")
+                else:
+                    row[c] = cell
+            if not row[cols[0]]:
+                print(f"WARNING: {path} line {line}: no {cols[0]}; skipped.")
+                continue
+            out.append(row)
+    return out
+
+def write_table(df: pd.DataFrame, path: str, fmt: str = "csv") -> str:
+    """Write df to path as CSV, or with --format parquet to the same stem as .parquet
+    (columnar and smaller; falls back to CSV without a parquet engine). Returns the
+    path written."""
+    if fmt == "parquet":
+        out = str(Path(path).with_suffix(".parquet"))
+        try:
+            df.to_parquet(out, index=False)
+            return out
+        except ImportError as e:
+            print(f"WARNING: parquet engine unavailable ({e}); writing CSV instead.")
+    df.to_csv(path, index=False)
+    return path
@@ -22,17 +22,45 @@
 #
 # Dependencies: requests, pandas
 
-import argparse, datetime as dt, json, time
+import argparse, datetime as dt, hashlib, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Dict, Any, Tuple
-import pandas as pd, requests
+import numpy as np, pandas as pd, requests
+from requests.adapters import HTTPAdapter
+
+from screener_common import read_holdings_rows, write_table
+
+try:  # C JSON parser/writer when available
+    import orjson
+    _loads = orjson.loads
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj, indent=2).encode()
 
 CG_BASE = "https://api.coingecko.com/api/v3"
 HEADERS = {"User-Agent": "tfsa-llm/crypto-screener"}
 
+# independent pages/chunks go out in parallel over one keep-alive session; the
+# worker cap bounds in-flight requests (free tier allows ~30-50/min)
+CG_WORKERS = 5
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=CG_WORKERS, pool_maxsize=CG_WORKERS))
+
+# responses are kept on disk so re-runs within the TTL skip the network (and the
+# rate limiter); coins/list (~10k entries) barely changes and gets a day
+CACHE_DIR = Path.home() / ".cache" / "stocks" / "coingecko"
+CACHE_TTL = 3600.0  # seconds; set from --cache-ttl, 0 (--no-cache) disables the cache
+LONG_TTL = {"coins/list": 24 * 3600.0}
+# holding symbols resolved through coins/list, kept so the list is only needed for new ones
+SYM2ID_FILE = CACHE_DIR / "sym2id.json"
+
 # ---- BAKED-IN FEE ----
 FEE_RATE = 0.02  # 2% Wealthsimple Crypto spread
 
-DEFAULT_WS_SUPPORTED = [
+DEFAULT_WS_SUPPORTED = frozenset({
   "ZRX","1INCH","AAVE","ALGO","ANKR","APE","API3","ARB","AVAX","AXS",
   "BNT","BAND","BAT","BNB","BTC","BCH","BLUR","BONK","ADA","CTSI","TIA",
   "CELO","LINK","CHZ","CHR","COMP","ATOM","COTI","CRV","MANA","DOGE","WIF",
@@ -44,17 +72,43 @@ DEFAULT_WS_SUPPORTED = [
   "RAY","RENDER","SEI","SHIB","SKL","SOL","S","SPX","XLM","STORJ","SUI",
   "SUPER","SUSHI","SNX","XTZ","GRT","TON","SAND","RUNE","TURBO","UMA",
   "UNI","USDC","VIRTUAL","WLFI","WLD","W","XRP","YFI","YGG"
-]
+})
 
 # ------ HTTP helpers
+def cache_file(path: str, params: Dict[str, Any] | None) -> Path:
+    key = json.dumps([path.strip("/"), sorted((params or {}).items())])
+    return CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+def cache_store(cf: Path, body: bytes) -> None:
+    # tmp name per thread, then an atomic rename: concurrent chunks never see a torn file
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = cf.with_name(f"{cf.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, cf)
+    except OSError as e:
+        print("WARNING: failed to write CoinGecko cache:", e)
+
 def cg_get(path: str, params: Dict[str, Any] | None = None, retries: int = 3, backoff: float = 1.2):
+    ttl = LONG_TTL.get(path.strip("/"), CACHE_TTL) if CACHE_TTL > 0 else 0
+    cf = cache_file(path, params)
+    if ttl > 0:
+        try:
+            if time.time() - cf.stat().st_mtime < ttl:
+                return _loads(cf.read_bytes())
+        except (OSError, ValueError):
+            pass  # missing or unreadable entry: fetch it again
+
     url = f"{CG_BASE}/{path.lstrip('/')}"
     last = None
     for i in range(retries):
         try:
-            r = requests.get(url, headers=HEADERS, params=params or {}, timeout=20)
+            r = SESSION.get(url, params=params or {}, timeout=20)
             if r.status_code == 200:
-                return r.json()
+                data = _loads(r.content)
+                if ttl > 0:
+                    cache_store(cf, r.content)  # raw body: no re-encode
+                return data
             last = RuntimeError(f"HTTP {r.status_code}: {r.text[:160]}")
         except Exception as e:
             last = e
@@ -62,16 +116,16 @@ def cg_get(path: str, params: Dict[str, Any] | None = None, retries: int = 3, ba
     raise last if last else RuntimeError("coingecko request failed")
 
 # ------ config loaders
-def load_supported_symbols(path: str | None) -> set[str]:
+def load_supported_symbols(path: str | None) -> frozenset[str]:
     if path:
         try:
             data = json.loads(open(path, "r").read())
-            syms = {str(s).upper().strip() for s in data if str(s).strip()}
+            syms = frozenset(str(s).upper().strip() for s in data if str(s).strip())
             if syms:
                 return syms
         except Exception as e:
             print(f"WARNING: failed to read --supported-file ({e}); falling back to default list.")
-    return set(DEFAULT_WS_SUPPORTED)
+    return DEFAULT_WS_SUPPORTED
 
 def load_symbol_map(path: str | None) -> dict:
     """
@@ -87,18 +141,28 @@ def load_symbol_map(path: str | None) -> dict:
         return {}
 
 # ------ data fetch
+def dedup_by_market_cap(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per symbol, the highest market cap winning (null caps rank last).
+
+    A single groupby pass instead of sorting the whole frame; pages arrive in
+    market-cap order, so keeping the winners in row order matches the old sort.
+    """
+    cap = df["market_cap"].astype("float64").fillna(-np.inf)
+    idx = cap.groupby(df["symbol"], sort=False).idxmax()
+    return df.loc[np.sort(idx.to_numpy())]
+
 def fetch_markets_cad(per_page: int = 250, pages: int = 1) -> pd.DataFrame:
-    rows = []
-    for p in range(1, pages + 1):
-        payload = cg_get("coins/markets", {
+    def page(p: int):
+        return cg_get("coins/markets", {
             "vs_currency":"cad",
             "order":"market_cap_desc",
             "per_page": per_page,
             "page": p,
             "price_change_percentage": "7d"
         })
-        rows.extend(payload)
-        time.sleep(0.6)  # be nice to API
+    # map keeps page order, so rows come back in market-cap order as before
+    with ThreadPoolExecutor(max(1, min(CG_WORKERS, pages))) as ex:
+        rows = [coin for payload in ex.map(page, range(1, pages + 1)) for coin in payload]
     if not rows:
         return pd.DataFrame()
     df = pd.DataFrame(rows)
@@ -109,11 +173,9 @@ def fetch_markets_cad(per_page: int = 250, pages: int = 1) -> pd.DataFrame:
         "price_change_percentage_7d_in_currency":"pct_change_1w"
     })
     df["symbol"] = df["symbol"].str.upper()
-    # de-dup by symbol preferring highest market cap
-    df = df.sort_values("market_cap", ascending=False).drop_duplicates(subset=["symbol"], keep="first")
-    return df
+    return dedup_by_market_cap(df)
 
-def fetch_supported_coins_only(supported_symbols: set[str]) -> pd.DataFrame:
+def fetch_supported_coins_only(supported_symbols: frozenset[str]) -> pd.DataFrame:
     """
     Optimized fetch that only gets data for Wealthsimple-supported symbols.
     Uses /coins/markets with a smaller page size and filters early to minimize API calls.
@@ -173,57 +235,62 @@ def fetch_supported_coins_only(supported_symbols: set[str]) -> pd.DataFrame:
     if missing_symbols:
         print(f"WARNING: Could not find market data for {len(missing_symbols)} symbols: {sorted(missing_symbols)}")
     
-    # de-dup by symbol preferring highest market cap
-    df = df.sort_values("market_cap", ascending=False).drop_duplicates(subset=["symbol"], keep="first")
+    df = dedup_by_market_cap(df)
     print(f"Successfully fetched data for {len(df)} supported coins")
     return df
 
 def read_holdings_csv(path: str) -> list[dict]:
-    out = []
-    h = pd.read_csv(path)
-    cols = {c.lower(): c for c in h.columns}
-    req = ["symbol","amount","avg_cost_cad"]
-    if not all(k in (x.lower() for x in h.columns) for k in req):
-        print("WARNING: holdings file missing required columns (symbol,amount,avg_cost_cad). Ignoring holdings.")
-        return out
-    for _, r in h.iterrows():
-        out.append({
-            "symbol": str(r[cols["symbol"]]).upper().strip(),
-            "amount": float(r[cols["amount"]]),
-            "avg_cost_cad": float(r[cols["avg_cost_cad"]])
-        })
-    return out
+    rows = read_holdings_rows(path, ["symbol","amount","avg_cost_cad"], numeric=("amount","avg_cost_cad"))
+    for r in rows:
+        r["symbol"] = r["symbol"].upper()
+    return rows
 
 # ------ holdings price enrichment
 def build_symbol_to_id(df_markets: pd.DataFrame) -> dict:
     # Map symbol->id from markets df
-    return {row["symbol"]: row["id"] for _, row in df_markets.iterrows()}
+    return dict(zip(df_markets["symbol"], df_markets["id"]))
+
+def load_resolved_ids() -> dict:
+    if CACHE_TTL <= 0: return {}  # --no-cache
+    try:
+        return _loads(SYM2ID_FILE.read_bytes())
+    except (OSError, ValueError):
+        return {}
 
 def lookup_ids_for_symbols(symbols: list[str], sym2id: dict, sym_map: dict) -> dict:
-    """Return symbol->id, using markets map, then symbol-map, finally /coins/list fuzzy match."""
+    """Return symbol->id, using markets map, then symbol-map, then ids resolved on earlier
+    runs, finally /coins/list fuzzy match (new resolutions are saved for next time)."""
     out: dict[str,str] = {}
     missing = []
+    resolved = load_resolved_ids()
     for s in symbols:
         if s in sym2id:
             out[s] = sym2id[s]
         elif s in sym_map:
             out[s] = sym_map[s]
+        elif s in resolved:
+            out[s] = resolved[s]
         else:
             missing.append(s)
     if missing:
         try:
             lst = cg_get("coins/list")  # id, symbol, name
-            # prefer exact symbol match; if multiple, first is fine
-            sym_groups: dict[str, list[str]] = {}
+            # prefer exact symbol match; if multiple, first is fine. Only the few
+            # missing symbols are tracked, and the scan stops once all are found.
+            want = set(missing)
+            found: dict[str, str] = {}
             for item in lst:
                 sym = str(item.get("symbol","")).upper()
+                if not sym or sym not in want or sym in found: continue
                 cid = str(item.get("id",""))
-                if not sym or not cid: continue
-                sym_groups.setdefault(sym, []).append(cid)
+                if not cid: continue
+                found[sym] = cid
+                if len(found) == len(want): break
             for s in missing:
-                cands = sym_groups.get(s, [])
-                if cands:
-                    out[s] = cands[0]
+                if s in found:
+                    out[s] = found[s]
+            if found and CACHE_TTL > 0:
+                cache_store(SYM2ID_FILE, _dumps({**resolved, **found}))
         except Exception as e:
             print("WARNING: failed to fetch coins/list for fallback symbol resolution:", e)
     return out
@@ -232,18 +299,18 @@ def fetch_simple_prices_cad(ids: list[str]) -> dict:
     if not ids: return {}
     # CoinGecko 'simple/price' supports up to ~250 ids per request
     CHUNK = 200
+    chunks = [ids[i:i+CHUNK] for i in range(0, len(ids), CHUNK)]
     prices: dict[str, float] = {}
-    for i in range(0, len(ids), CHUNK):
-        sub = ids[i:i+CHUNK]
-        resp = cg_get("simple/price", {"ids": ",".join(sub), "vs_currencies": "cad"})
-        for cid, obj in resp.items():
-            if "cad" in obj:
-                prices[cid] = float(obj["cad"])
-        time.sleep(0.6)
+    with ThreadPoolExecutor(min(CG_WORKERS, len(chunks))) as ex:
+        for resp in ex.map(lambda sub: cg_get("simple/price", {"ids": ",".join(sub), "vs_currencies": "cad"}), chunks):
+            for cid, obj in resp.items():
+                if "cad" in obj:
+                    prices[cid] = float(obj["cad"])
     return prices
 
 # ------ main
 def main():
+    global CACHE_TTL
     ap = argparse.ArgumentParser(description="Weekly crypto top40 (CoinGecko) → LLM JSON (with holdings prices, fee baked-in)")
     ap.add_argument("--cash", type=float, default=0.0, help="Cash available in CAD")
     ap.add_argument("--holdings", type=str, default=None, help="Path to crypto holdings CSV (symbol,amount,avg_cost_cad)")
@@ -260,7 +327,11 @@ def main():
     ap.add_argument("--pages", type=int, default=1, help="How many pages of top market cap coins to pull (250 per page) - ignored when using --optimized")
     ap.add_argument("--optimized", action="store_true", default=True, help="Use optimized API calls for supported symbols only (default: True)")
     ap.add_argument("--legacy", action="store_true", help="Use legacy method (fetch all coins then filter) - may hit rate limits")
+    ap.add_argument("--cache-ttl", type=float, default=CACHE_TTL, help=f"Seconds to reuse cached CoinGecko responses from {CACHE_DIR} (coins/list: 24h)")
+    ap.add_argument("--no-cache", action="store_true", help="Always hit CoinGecko; don't read or write the response cache")
+    ap.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Table output format (parquet needs pyarrow)")
     args = ap.parse_args()
+    CACHE_TTL = 0 if args.no_cache else args.cache_ttl
 
     supported = load_supported_symbols(args.supported_file)
     sym_map = load_symbol_map(args.symbol_map)
@@ -270,29 +341,29 @@ def main():
     if use_optimized:
         print("Using OPTIMIZED fetching for Wealthsimple-supported coins only...")
         df = fetch_supported_coins_only(supported)
+        keep = pd.Series(True, index=df.index)
     else:
         print(f"Using LEGACY method - fetching {args.pages} pages of all coins then filtering...")
-        df = fetch_markets_cad(per_page=250, pages=args.pages)
-        if not df.empty:
-            df = df[df["symbol"].isin(supported)].copy()
-    
-    if df.empty:
+        df = df_all = fetch_markets_cad(per_page=250, pages=args.pages)
+        keep = df["symbol"].isin(supported) if not df.empty else pd.Series(dtype=bool)
+
+    if not keep.any():
         raise SystemExit("No market data from CoinGecko; aborting.")
 
-    # Basic hygiene filtering
-    df = df[(df["price_cad"] >= args.min_price) & (df["vol_24h"] >= args.min_volume)].copy()
+    # Basic hygiene filtering, folded into the supported mask: one boolean index, one copy
+    df = df.loc[keep & (df["price_cad"] >= args.min_price) & (df["vol_24h"] >= args.min_volume)].copy()
 
     # Save raw candidates for transparency
-    output_path_raw = "../outputs/crypto_candidates_raw.csv"
-    df.sort_values("pct_change_1w", ascending=False).to_csv(output_path_raw, index=False)
+    output_path_raw = write_table(df.sort_values("pct_change_1w", ascending=False), "../outputs/crypto_candidates_raw.csv", args.format)
     print(f"Wrote {output_path_raw} with {len(df)} rows")
 
     # 2) Build top40 (up & down), each bucket volume-sorted
-    upN = df.sort_values("pct_change_1w", ascending=False).head(args.up_count).copy()
+    # heap-select the N movers instead of sorting the whole frame (NaN changes never qualify)
+    upN = df.nlargest(args.up_count, "pct_change_1w").copy()
     upN["bucket"] = "up"
     upN = upN.sort_values("vol_24h", ascending=False)
 
-    downN = df.sort_values("pct_change_1w", ascending=True).head(args.down_count).copy()
+    downN = df.nsmallest(args.down_count, "pct_change_1w").copy()
     downN["bucket"] = "down"
     downN = downN.sort_values("vol_24h", ascending=False)
 
@@ -313,11 +384,9 @@ def main():
         sym2id = build_symbol_to_id(df)
         print(f"Built symbol-to-ID mapping for {len(sym2id)} coins (optimized mode)")
     else:
-        # Legacy mode: expand mapping using full markets universe for better coverage
-        sym2id_market = build_symbol_to_id(df)
-        df_full = fetch_markets_cad(per_page=250, pages=max(1, args.pages))
-        sym2id_full = build_symbol_to_id(df_full)
-        sym2id = {**sym2id_full, **sym2id_market}
+        # Legacy mode: map from the unfiltered markets pages for better coverage
+        # (the filtered df is a subset of them, so no second fetch is needed)
+        sym2id = build_symbol_to_id(df_all)
         print(f"Built symbol-to-ID mapping for {len(sym2id)} coins (legacy mode)")
 
     holding_symbols = [h["symbol"] for h in holdings_list]
@@ -353,11 +422,14 @@ def main():
     if rows_hold:
         short = pd.concat([short, pd.DataFrame(rows_hold)], ignore_index=True)
 
-    output_path_short = "../outputs/crypto_shortlist_top40.csv"
-    short.to_csv(output_path_short, index=False)
+    output_path_short = write_table(short, "../outputs/crypto_shortlist_top40.csv", args.format)
     print(f"Wrote {output_path_short} with {len(short)} symbols (including holdings)")
 
     # 5) Build LLM payload
+    # fee-adjusted prices for the whole shortlist in one array op (NaN where unpriced);
+    # the built-in round() below keeps the 6-dp values identical to the per-dict math
+    px = short["price_cad"].to_numpy(dtype="float64")
+    eff_buy, eff_sell = (px * (1.0 + FEE_RATE)).tolist(), (px * (1.0 - FEE_RATE)).tolist()
     payload = {
         "as_of": dt.date.today().isoformat(),
         "exchange": "Wealthsimple Crypto (non-registered)",
@@ -373,32 +445,28 @@ def main():
         "holdings": holdings_list,  # includes market_price_cad now
         "candidates": [
             {
-                "id": (r["id"] if pd.notnull(r["id"]) else ""),
-                "symbol": r["symbol"],
-                "name": r["name"] if "name" in r and pd.notnull(r["name"]) else r["symbol"],
-                "price_cad": (float(r["price_cad"]) if pd.notnull(r["price_cad"]) else None),
-                "pct_change_1w": (float(r["pct_change_1w"]) if pd.notnull(r["pct_change_1w"]) else None),
-                "vol_24h": (float(r["vol_24h"]) if pd.notnull(r["vol_24h"]) else None),
-                "bucket": r["bucket"]
+                "id": (r.id if pd.notnull(r.id) else ""),
+                "symbol": r.symbol,
+                "name": r.name if pd.notnull(r.name) else r.symbol,
+                "price_cad": (float(r.price_cad) if pd.notnull(r.price_cad) else None),
+                "pct_change_1w": (float(r.pct_change_1w) if pd.notnull(r.pct_change_1w) else None),
+                "vol_24h": (float(r.vol_24h) if pd.notnull(r.vol_24h) else None),
+                "bucket": r.bucket,
+                "effective_buy_price_cad": (round(b, 6) if pd.notnull(r.price_cad) else None),
+                "effective_sell_price_cad": (round(sl, 6) if pd.notnull(r.price_cad) else None),
             }
-            for _, r in short.iterrows()
+            for r, b, sl in zip(short.itertuples(index=False), eff_buy, eff_sell)
         ]
     }
 
-    # Add effective buy/sell prices (fee-aware) to candidates and to holdings (if priced)
-    for c in payload["candidates"]:
-        p = c.get("price_cad")
-        c["effective_buy_price_cad"]  = (None if p is None else round(p * (1.0 + FEE_RATE), 6))
-        c["effective_sell_price_cad"] = (None if p is None else round(p * (1.0 - FEE_RATE), 6))
-
+    # Add effective buy/sell prices (fee-aware) to holdings (if priced)
     for h in payload["holdings"]:
         mp = h.get("market_price_cad")
         h["effective_buy_price_cad"]  = (None if mp is None else round(mp * (1.0 + FEE_RATE), 6))
         h["effective_sell_price_cad"] = (None if mp is None else round(mp * (1.0 - FEE_RATE), 6))
 
     output_path = "../outputs/llm_candidates_crypto.json"
-    with open(output_path, "w") as f:
-        json.dump(payload, f, indent=2)
+    Path(output_path).write_bytes(_dumps(payload))
     print(f"Wrote {output_path} with {len(payload['candidates'])} candidates")
 
 if __name__ == "__main__":
@@ -20,11 +20,27 @@
 #   python3 screener_top40_fractional.py --cash 10 --fractional --min-trade-size 1 --holdings holdings.csv --tsx-only
 #   python3 screener_top40_fractional.py --cash 500 --holdings holdings.csv
 #
-# Dependencies: yfinance pandas requests lxml html5lib beautifulsoup4
+# Dependencies: yfinance pandas requests lxml
 
 import argparse, datetime as dt, io, json, re, time
+from functools import lru_cache
+from pathlib import Path
 from typing import List
-import pandas as pd, requests, yfinance as yf
+import lxml.html
+import numpy as np, pandas as pd, requests, yfinance as yf
+
+from screener_common import read_holdings_rows, write_table
+
+try:  # optional: compiled snapshot kernel (pip install numba)
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+try:  # C JSON writer when available
+    import orjson
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    _dumps = lambda obj: json.dumps(obj, indent=2).encode()
 
 UA = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15"}
 
@@ -42,10 +58,20 @@ def fetch_html(url: str, max_retries: int = 3, backoff: float = 1.0) -> str:
         time.sleep(backoff * (2 ** i))
     raise last_err if last_err else RuntimeError("Unknown fetch error")
 
+WIKITABLE_XPATH = "//table[contains(concat(' ', normalize-space(@class), ' '), ' wikitable ')]"
+
+def read_wikitables(html: str, first: bool = False) -> List[pd.DataFrame]:
+    """pd.read_html over only the page's wikitable(s); the navboxes and sidebars
+    around them are most of the tables on these pages. Falls back to the whole
+    page if no wikitable is found."""
+    tbls = lxml.html.fromstring(html).xpath(WIKITABLE_XPATH)
+    if first: tbls = tbls[:1]
+    if not tbls: return pd.read_html(io.StringIO(html), flavor="lxml")
+    return pd.read_html(io.StringIO("".join(lxml.html.tostring(t, encoding="unicode") for t in tbls)), flavor="lxml")
+
 def get_sp500_from_wikipedia() -> List[str]:
     html = fetch_html("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")
-    tables = pd.read_html(io.StringIO(html))
-    df = tables[0]
+    df = read_wikitables(html, first=True)[0]  # the constituents table comes first
     symcol = "Symbol" if "Symbol" in df.columns else [c for c in df.columns if "symbol" in str(c).lower()][0]
     return df[symcol].astype(str).str.strip().tolist()
 
@@ -59,29 +85,31 @@ def get_sp500() -> List[str]:
         except Exception as e2:
             raise RuntimeError(f"Could not retrieve S&P 500 tickers: {e2}")
 
+TICKER_RE = re.compile(r"^[A-Z][A-Z0-9.\-]{0,6}$")
+SYMBOL_HEADERS = ("symbol", "ticker", "ticker symbol")
+
+def plausible_tickers(col: pd.Series) -> List[str] | None:
+    # at least ~15 ticker-looking values making up >50% of the column
+    vals = col.astype(str).str.strip().dropna()
+    if len(vals) == 0: return None
+    matches = vals[vals.str.match(TICKER_RE)]
+    if len(matches) >= 15 and len(matches) / max(1, len(vals)) > 0.5:
+        return matches.unique().tolist()
+    return None
+
 def get_tsx60() -> List[str]:
     html = fetch_html("https://en.wikipedia.org/wiki/S%26P/TSX_60")
-    tables = pd.read_html(io.StringIO(html))
+    tables = read_wikitables(html)
     if not tables:
         raise RuntimeError("No tables on TSX-60 page")
-    ticker_re = re.compile(r"^[A-Z][A-Z0-9.\-]{0,6}$")
-    best = None
-    for tbl in tables:
-        for col in tbl.columns:
-            series = tbl[col].astype(str).str.strip()
-            vals = series.dropna()
-            if len(vals) == 0: continue
-            matches = vals[vals.str.match(ticker_re)]
-            if len(matches) >= 15 and len(matches) / max(1, len(vals)) > 0.5:
-                best = matches.unique().tolist()
-                break
-        if best: break
+    # cheap path first: the column headed Symbol/Ticker (values still sanity-checked)
+    named = [tbl[c] for tbl in tables for c in tbl.columns if str(c).strip().lower() in SYMBOL_HEADERS]
+    best = next((b for b in map(plausible_tickers, named) if b), None)
+    # header renamed: sniff every column by content, else trust any Symbol/Ticker column
     if not best:
-        for tbl in tables:
-            for name in tbl.columns:
-                if str(name).strip().lower() in ("symbol", "ticker", "ticker symbol"):
-                    best = tbl[name].astype(str).str.strip().unique().tolist(); break
-            if best: break
+        best = next((b for tbl in tables for c in tbl.columns if (b := plausible_tickers(tbl[c]))), None)
+    if not best and named:
+        best = named[0].astype(str).str.strip().unique().tolist() or None
     if not best:
         raise RuntimeError("Couldn't find a plausible Symbol/Ticker column for TSX-60")
     return [s if s.endswith(".TO") else f"{s}.TO" for s in best]
@@ -92,6 +120,11 @@ MANUAL_FIXES = {
     "BIP.UN.TO":"BIP-UN.TO","CAR.UN.TO":"CAR-UN.TO","GIB.A.TO":"GIB-A.TO",
     "TECK.B.TO":"TECK-B.TO","CTC.A.TO":"CTC-A.TO","RCI.B.TO":"RCI-B.TO","CCL.B.TO":"CCL-B.TO",
 }
+CLASS_TO_RE = re.compile(r"^([A-Z0-9]+)\.([A-Z]{1,3})\.TO$")   # TECK.B.TO
+DISPLAY_RE = re.compile(r"^([A-Z0-9]+)-([A-Z]+)(\.TO)$")        # TECK-B.TO
+
+# the same few hundred symbols come through for the universe, holdings and shortlist
+@lru_cache(maxsize=None)
 def normalize_symbol(sym: str) -> str:
     s = sym.strip().upper()
     if s in MANUAL_FIXES: return MANUAL_FIXES[s]
@@ -99,38 +132,93 @@ def normalize_symbol(sym: str) -> str:
         parts = s.split(".")
         if len(parts)==2 and len(parts[1])<=3: return f"{parts[0]}-{parts[1]}"
     if s.endswith(".TO"):
-        m = re.match(r"^([A-Z0-9]+)\.([A-Z]{1,3})\.TO$", s)
+        m = CLASS_TO_RE.match(s)
         if m: return f"{m.group(1)}-{m.group(2)}.TO"
     return s
 
 def denormalize_to_display(sym: str) -> str:
     # TECK-B.TO -> TECK.B.TO (Wealthsimple display)
     s = sym.strip().upper()
-    return re.sub(r"^([A-Z0-9]+)-([A-Z]+)(\.TO)$", r"\1.\2\3", s)
-
-def pct_1w(series: pd.Series) -> float:
-    if len(series) < 6: return float("nan")
-    return (series.iloc[-1] / series.iloc[-6] - 1) * 100.0
+    return DISPLAY_RE.sub(r"\1.\2\3", s)
 
 def is_cad(sym: str) -> bool: return sym.endswith(".TO")
 
+# ---------- weekly snapshot
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _snapshot_nb(close, vol, valid):
+        # one walk back per ticker over its own valid bars; matches the NumPy
+        # path below on every ticker with 6+ bars (the rest are dropped)
+        ndays, n = close.shape
+        last = np.full(n, np.nan)
+        ref = np.full(n, np.nan)
+        vol5 = np.full(n, np.nan)
+        for j in prange(n):
+            seen = 0
+            vsum = 0.0
+            for i in range(ndays - 1, -1, -1):
+                if not valid[i, j]:
+                    continue
+                if seen == 0:
+                    last[j] = close[i, j]
+                if seen < 5:
+                    vsum += vol[i, j]
+                seen += 1
+                if seen == 6:
+                    ref[j] = close[i, j]
+                    break
+            if seen >= 5:
+                vol5[j] = vsum / 5
+        return last, ref, vol5
+else:
+    _snapshot_nb = None
+
+def snapshot_arrays(close: np.ndarray, vol: np.ndarray, valid: np.ndarray):
+    """Last close, close 5 bars earlier and 5-bar mean volume per column of (days, tickers)."""
+    if _snapshot_nb is not None:
+        return _snapshot_nb(close, vol, valid)
+    if len(close) < 6:  # not even a week of bars came back
+        nan = np.full(close.shape[1], np.nan)
+        return nan, nan, nan
+    # stable sort on the mask pushes each column's gaps to the top, keeping bar order
+    order = np.argsort(valid, axis=0, kind="stable")
+    close = np.take_along_axis(close, order, axis=0)
+    vol = np.take_along_axis(vol, order, axis=0)
+    return close[-1], close[-6], vol[-5:].mean(axis=0)
+
+def weekly_snapshot(hist: pd.DataFrame, tickers: List[str]) -> tuple[pd.DataFrame, list]:
+    """close / pct_change_1w / avg_volume_5d for every ticker in one pass over the
+    (days × tickers) Close and Volume frames, instead of slicing hist[t] per ticker.
+
+    A bar counts only if all its fields are present (what hist[t].dropna() kept), and
+    each ticker skips its own gaps since NYSE and TSX holidays differ; tickers with
+    fewer than 6 bars go to the failed list.
+    """
+    present = hist.columns.get_level_values(0)
+    valid = hist.notna().T.groupby(level=0).all().T.reindex(columns=tickers, fill_value=False)
+    close = hist.xs("Close", axis=1, level=1).reindex(columns=tickers).to_numpy(dtype="float64")
+    vol = hist.xs("Volume", axis=1, level=1).reindex(columns=tickers).to_numpy(dtype="float64")
+
+    last, ref, vol5 = snapshot_arrays(close, vol, valid.to_numpy())
+    ok = valid.sum().to_numpy() >= 6
+    keep = [t for t, k in zip(tickers, ok) if k]
+    last, ref, vol5 = last[ok], ref[ok], vol5[ok]
+    df = pd.DataFrame({
+        "ticker": keep,
+        "close": [round(x, 2) for x in last.tolist()],  # built-in round, as on the old float()
+        "pct_change_1w": np.round((last / ref - 1) * 100.0, 2),
+        "avg_volume_5d": vol5.astype("int64"),
+        "listing": ["CAD" if is_cad(t) else "USD" for t in keep],
+    })
+    failed = [(t, "too_short" if t in present else "no_data") for t, k in zip(tickers, ok) if not k]
+    return df, failed
+
 # ---------- holdings read
 def read_holdings_csv(path: str) -> list[dict]:
-    out = []
-    h = pd.read_csv(path)
-    cols = {c.lower(): c for c in h.columns}
-    req = ["ticker","shares","avg_cost","currency"]
-    if not all(r in (x.lower() for x in h.columns) for r in req):
-        print("WARNING: holdings.csv missing required columns; ignoring.")
-        return out
-    for _, r in h.iterrows():
-        out.append({
-            "ticker": str(r[cols["ticker"]]).strip(),
-            "shares": float(r[cols["shares"]]),
-            "avg_cost": float(r[cols["avg_cost"]]),
-            "currency": str(r[cols["currency"]]).strip().upper()
-        })
-    return out
+    rows = read_holdings_rows(path, ["ticker","shares","avg_cost","currency"], numeric=("shares","avg_cost"))
+    for r in rows:
+        r["currency"] = r["currency"].upper()
+    return rows
 
 # ---------- price lookup
 def last_close_from_hist(hist: pd.DataFrame, yf_ticker: str) -> float | None:
@@ -141,13 +229,14 @@ def last_close_from_hist(hist: pd.DataFrame, yf_ticker: str) -> float | None:
     except Exception:
         return None
 
-def last_close_single(yf_ticker: str) -> float | None:
+def last_closes_batch(yf_tickers: List[str]) -> dict:
+    """Last close per ticker from one threaded 5-day download (None where unavailable)."""
+    if not yf_tickers: return {}
     try:
-        df = yf.Ticker(yf_ticker).history(period="5d", interval="1d", auto_adjust=True)
-        if df is None or df.empty: return None
-        return float(df["Close"].iloc[-1])
+        df = yf.download(yf_tickers, period="5d", interval="1d", group_by="ticker", auto_adjust=True, threads=True)
     except Exception:
-        return None
+        return {}
+    return {t: last_close_from_hist(df, t) for t in yf_tickers}
 
 def main():
     p = argparse.ArgumentParser(description="Weekly top40 with optional fractional mode (holdings-aware, TSX-first)")
@@ -162,6 +251,7 @@ def main():
     p.add_argument("--min-trade-size", type=float, default=100.0, help="Minimum CAD per trade")
     p.add_argument("--fractional", action="store_true", help="Allow fractional shares (LLM may propose decimals)")
     p.add_argument("--tsx-only", action="store_true", help="Restrict to Toronto Stock Exchange (.TO) only; avoids USD/FX")
+    p.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Table output format (parquet needs pyarrow)")
     args = p.parse_args()
 
     # 1) Universe
@@ -173,25 +263,8 @@ def main():
     hist = yf.download(universe_norm, start=start, end=end, interval="1d", group_by="ticker", auto_adjust=True, threads=True)
 
     # 2) Build raw dataframe
-    rows, failed = [], []
-    for t in universe_norm:
-        try:
-            df = hist[t].dropna()
-            if len(df) < 6: failed.append((t,"too_short")); continue
-            close_today = float(df["Close"].iloc[-1])
-            change = pct_1w(df["Close"])
-            avg_vol_5 = float(df["Volume"].tail(5).mean())
-            rows.append({
-                "ticker": t,
-                "close": round(close_today, 2),
-                "pct_change_1w": round(change, 2),
-                "avg_volume_5d": int(avg_vol_5),
-                "listing": "CAD" if is_cad(t) else "USD",
-            })
-        except Exception as e:
-            failed.append((t, str(e)))
-
-    df_all = pd.DataFrame(rows).sort_values("pct_change_1w", ascending=False)
+    df_all, failed = weekly_snapshot(hist, universe_norm)
+    df_all = df_all.sort_values("pct_change_1w", ascending=False)
     if args.tsx_only:
         df_all = df_all[df_all["listing"] == "CAD"].copy()
 
@@ -200,21 +273,21 @@ def main():
     df_all["currency"] = df_all["listing"].map({"CAD":"CAD","USD":"USD"})
     df_all["fractional_supported"] = bool(args.fractional)
 
-    output_path_raw = "../outputs/candidates_raw.csv"
-    df_all.to_csv(output_path_raw, index=False)
+    output_path_raw = write_table(df_all, "../outputs/candidates_raw.csv", args.format)
     print(f"Wrote {output_path_raw} with {len(df_all)} tickers")
     if failed:
-        pd.DataFrame(failed, columns=["ticker","reason"]).to_csv("failed_tickers.csv", index=False)
-        print(f"Logged {len(failed)} failed/short symbols → failed_tickers.csv")
+        failed_path = write_table(pd.DataFrame(failed, columns=["ticker","reason"]), "failed_tickers.csv", args.format)
+        print(f"Logged {len(failed)} failed/short symbols → {failed_path}")
     if df_all.empty: raise SystemExit("No data retrieved; aborting.")
 
     # 3) Liquidity filters + top40
     liq_thresh = df_all["avg_volume_5d"].quantile(0.25)
     df_filt = df_all[(df_all["close"] >= args.min_price) & (df_all["avg_volume_5d"] >= max(args.min_volume, liq_thresh))].copy()
 
-    up = df_filt.sort_values("pct_change_1w", ascending=False).head(args.up_count)
+    # heap-select the N movers; only those N get the volume sort
+    up = df_filt.nlargest(args.up_count, "pct_change_1w")
     up = up.sort_values("avg_volume_5d", ascending=False).copy(); up["bucket"] = "up"
-    down = df_filt.sort_values("pct_change_1w", ascending=True).head(args.down_count)
+    down = df_filt.nsmallest(args.down_count, "pct_change_1w")
     down = down.sort_values("avg_volume_5d", ascending=False).copy(); down["bucket"] = "down"
     short = pd.concat([up, down]).drop_duplicates(subset=["ticker"]).reset_index(drop=True)
 
@@ -227,20 +300,21 @@ def main():
             print("WARNING: failed to read holdings.csv:", e)
             holdings_list = []
 
-    for h in holdings_list:
-        raw = h["ticker"]
-        yf_sym = normalize_symbol(raw)
-        price = last_close_from_hist(hist, yf_sym) or last_close_single(yf_sym)
+    yf_syms = [normalize_symbol(h["ticker"]) for h in holdings_list]
+    prices = {s: last_close_from_hist(hist, s) for s in yf_syms}
+    # holdings outside the screened universe: one batched download, not a history() call each
+    prices.update(last_closes_batch([s for s, p in prices.items() if not p]))
+    for h, yf_sym in zip(holdings_list, yf_syms):
+        price = prices.get(yf_sym)
         h["market_price"] = round(float(price), 4) if price is not None else None
         h["market_price_cad"] = h["market_price"]
-        h["ticker"] = denormalize_to_display(normalize_symbol(raw))
+        h["ticker"] = denormalize_to_display(yf_sym)
 
     # 5) Append holdings as candidates (bucket="holding") if not already present
-    def to_norm(s: str) -> str: return normalize_symbol(s)
     candidate_norms = set(short["ticker"])
     rows_hold = []
     for h in holdings_list:
-        norm_sym = to_norm(h["ticker"])
+        norm_sym = normalize_symbol(h["ticker"])
         if norm_sym in candidate_norms: continue
         rows_hold.append({
             "ticker": norm_sym,
@@ -259,8 +333,7 @@ def main():
     short_disp = short.copy()
     short_disp["ticker"] = short_disp["ticker"].apply(denormalize_to_display)
 
-    output_path_short = "../outputs/shortlist_top40.csv"
-    short.to_csv(output_path_short, index=False)
+    output_path_short = write_table(short, "../outputs/shortlist_top40.csv", args.format)
     print(f"Wrote {output_path_short} with {len(short)} tickers (including holdings)")
 
     # 6) Build JSON payload
@@ -278,22 +351,21 @@ def main():
         "holdings": holdings_list,
         "candidates": [
             {
-                "ticker": r["ticker"],
-                "currency": "CAD" if r["listing"]=="CAD" else "USD",
-                "price": (float(r["close"]) if pd.notnull(r["close"]) else None),
-                "price_cad": (float(r["price_cad"]) if "price_cad" in r and pd.notnull(r["price_cad"]) else (float(r["close"]) if pd.notnull(r["close"]) else None)),
-                "pct_change_1w": (float(r["pct_change_1w"]) if pd.notnull(r["pct_change_1w"]) else None),
-                "avg_volume_5d": (int(r["avg_volume_5d"]) if pd.notnull(r["avg_volume_5d"]) else None),
-                "listing": r["listing"],
-                "fractional_supported": bool(r["fractional_supported"]) if "fractional_supported" in r else bool(args.fractional),
-                "bucket": r["bucket"]
-            } for _, r in short_disp.iterrows()
+                "ticker": r.ticker,
+                "currency": "CAD" if r.listing=="CAD" else "USD",
+                "price": (float(r.close) if pd.notnull(r.close) else None),
+                "price_cad": (float(r.price_cad) if pd.notnull(r.price_cad) else (float(r.close) if pd.notnull(r.close) else None)),
+                "pct_change_1w": (float(r.pct_change_1w) if pd.notnull(r.pct_change_1w) else None),
+                "avg_volume_5d": (int(r.avg_volume_5d) if pd.notnull(r.avg_volume_5d) else None),
+                "listing": r.listing,
+                "fractional_supported": bool(r.fractional_supported),
+                "bucket": r.bucket
+            } for r in short_disp.itertuples(index=False)
         ]
     }
 
     output_path = "../outputs/llm_candidates.json"
-    with open(output_path, "w") as f:
-        json.dump(payload, f, indent=2)
+    Path(output_path).write_bytes(_dumps(payload))
     print(f"Wrote {output_path} with {len(payload['candidates'])} candidates")
 
 if __name__ == "__main__":
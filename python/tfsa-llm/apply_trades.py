@@ -16,25 +16,85 @@ Usage examples:
       --trades trades_crypto.json \
       --fills fills_crypto.csv \
       --out crypto_holdings.csv
+
+The apply step uses the compiled trade_apply extension when it has been built
+(python3 setup.py build_ext --inplace) and the pure-Python loops otherwise.
 """
 
-import argparse, csv, json, sys, time
+import argparse, bisect, csv, json, os, shutil, sys, time
 from decimal import Decimal, ROUND_HALF_UP
 from pathlib import Path
 
+try:  # C JSON parser when available
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:  # optional compiled apply loops (see setup.py)
+    from trade_apply import apply_equity_c, apply_crypto_c
+except ImportError:
+    apply_equity_c = apply_crypto_c = None
+
+# Quantities and prices are carried as scaled ints (6 dp shares/coins, 4 dp prices);
+# Decimal is only used by the --strict parity check. Fill prices keep every input
+# digit (price_n / 10**price_dp) so the weighted average sees the exact notional.
+SHARE_DP, PRICE_DP = 6, 4
+
 D = lambda x: Decimal(str(x))
 
+def _split_number(x):
+    """(negative, whole digits, fraction digits) of a decimal string/number."""
+    s = str(x).strip()
+    if "e" in s or "E" in s:  # floats from JSON may come through as 1e-05
+        s = format(Decimal(s), "f")
+    neg = s[:1] == "-"
+    if s[:1] in ("-", "+"):
+        s = s[1:]
+    whole, _, frac = s.partition(".")
+    if not (whole + frac).isdigit():
+        raise ValueError(f"invalid number: {x!r}")
+    return neg, whole, frac
+
+def to_scaled(x, dp):
+    """Parse a decimal string/number into an int scaled by 10**dp (ROUND_HALF_UP)."""
+    neg, whole, frac = _split_number(x)
+    n = int(whole or "0") * 10**dp + int(frac[:dp].ljust(dp, "0") or "0")
+    if frac[dp:dp+1] >= "5":
+        n += 1
+    return -n if neg else n
+
+def to_exact(x, min_dp):
+    """Parse without rounding: (n, dp) with x == n / 10**dp and dp >= min_dp."""
+    neg, whole, frac = _split_number(x)
+    frac = frac.rstrip("0").ljust(min_dp, "0")
+    n = int(whole + frac or "0")
+    return (-n if neg else n), len(frac)
+
+def fmt_scaled(n, dp):
+    sign = "-" if n < 0 else ""
+    i, f = divmod(abs(n), 10**dp)
+    return f"{sign}{i}.{f:0{dp}d}"
+
+def half_up(n, d):
+    """n / d rounded ROUND_HALF_UP (d > 0)."""
+    q = (2 * abs(n) + d) // (2 * d)
+    return q if n >= 0 else -q
+
+_Q_SHARES = Decimal("0.000000")
+_Q_PRICE  = Decimal("0.0001")
+
 def round_shares(x):  # support fractionals
-    return D(x).quantize(Decimal("0.000000"), rounding=ROUND_HALF_UP)
+    return (x if isinstance(x, Decimal) else D(x)).quantize(_Q_SHARES, rounding=ROUND_HALF_UP)
 
 def round_price(x):
-    return D(x).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+    return (x if isinstance(x, Decimal) else D(x)).quantize(_Q_PRICE, rounding=ROUND_HALF_UP)
 
 def die(msg):
     print(f"ERROR: {msg}", file=sys.stderr); sys.exit(1)
 
 def load_trades(trades_path, asset):
-    data = json.loads(Path(trades_path).read_text())
+    data = _json_loads(Path(trades_path).read_bytes())
     if "trades" not in data or not isinstance(data["trades"], list):
         die("trades JSON missing 'trades' array")
     key = "ticker" if asset == "equity" else "symbol"
@@ -46,182 +106,246 @@ def load_trades(trades_path, asset):
         if not sym: die(f"missing {key} in trade")
         qty = t.get("qty")
         if qty is None: die("missing qty in trade")
-        out.append({"action":act, key: str(sym).strip().upper(), "qty": D(qty)})
+        qty_e6 = to_scaled(qty, SHARE_DP)
+        if qty_e6 <= 0: die(f"qty must be positive in trade {act} {sym}")
+        out.append({"action":act, key: str(sym).strip().upper(), "qty_e6": qty_e6})
     return out
 
-def load_fills(fills_path, asset):
+def _header_index(r, req, what):
+    """Consume the header row and return the column position of each required field."""
+    header = next(r, [])
+    miss = [c for c in req if c not in header]
+    if miss: die(f"{what} CSV missing columns: {miss}")
+    return [header.index(c) for c in req]
+
+def _load_fills_equity(fills_path):
     rows = []
+    rows_append = rows.append
     with open(fills_path, newline="") as f:
-        r = csv.DictReader(f)
-        req = ("action","ticker","qty","fill_price","currency") if asset=="equity" \
-              else ("action","symbol","amount","fill_price_cad")
-        miss = [c for c in req if c not in r.fieldnames]
-        if miss: die(f"fills CSV missing columns: {miss}")
+        r = csv.reader(f)
+        i_act, i_tic, i_qty, i_px, i_cur = _header_index(r, ("action","ticker","qty","fill_price","currency"), "fills")
         for row in r:
-            action = row["action"].strip().lower()
-            if asset == "equity":
-                rows.append({
-                    "action": action,
-                    "ticker": row["ticker"].strip().upper(),
-                    "qty": D(row["qty"]),
-                    "fill_price": D(row["fill_price"]),
-                    "currency": row["currency"].strip().upper()
-                })
-            else:
-                rows.append({
-                    "action": action,
-                    "symbol": row["symbol"].strip().upper(),
-                    "amount": D(row["amount"]),
-                    "fill_price_cad": D(row["fill_price_cad"])
-                })
+            if not row: continue
+            price_n, price_dp = to_exact(row[i_px], PRICE_DP)
+            rows_append({
+                "action": row[i_act].strip().lower(),
+                "ticker": row[i_tic].strip().upper(),
+                "qty_e6": to_scaled(row[i_qty], SHARE_DP),
+                "price_n": price_n,
+                "price_dp": price_dp,
+                "currency": row[i_cur].strip().upper()
+            })
     return rows
 
-def load_holdings(holdings_path, asset):
+def _load_fills_crypto(fills_path):
+    rows = []
+    rows_append = rows.append
+    with open(fills_path, newline="") as f:
+        r = csv.reader(f)
+        i_act, i_sym, i_amt, i_px = _header_index(r, ("action","symbol","amount","fill_price_cad"), "fills")
+        for row in r:
+            if not row: continue
+            price_n, price_dp = to_exact(row[i_px], PRICE_DP)
+            rows_append({
+                "action": row[i_act].strip().lower(),
+                "symbol": row[i_sym].strip().upper(),
+                "amount_e6": to_scaled(row[i_amt], SHARE_DP),
+                "price_n": price_n,
+                "price_dp": price_dp
+            })
+    return rows
+
+def load_fills(fills_path, asset):
+    if asset == "equity":
+        return _load_fills_equity(fills_path)
+    return _load_fills_crypto(fills_path)
+
+def _load_holdings_equity(holdings_path):
     rows = []
+    rows_append = rows.append
     with open(holdings_path, newline="") as f:
-        r = csv.DictReader(f)
-        if asset == "equity":
-            req = ("ticker","shares","avg_cost","currency")
-        else:
-            req = ("symbol","amount","avg_cost_cad")
-        miss = [c for c in req if c not in r.fieldnames]
-        if miss: die(f"holdings CSV missing columns: {miss}")
+        r = csv.reader(f)
+        i_tic, i_sh, i_cost, i_cur = _header_index(r, ("ticker","shares","avg_cost","currency"), "holdings")
         for row in r:
-            if asset == "equity":
-                rows.append({
-                    "ticker": row["ticker"].strip().upper(),
-                    "shares": D(row["shares"]),
-                    "avg_cost": D(row["avg_cost"]),
-                    "currency": row["currency"].strip().upper()
-                })
-            else:
-                rows.append({
-                    "symbol": row["symbol"].strip().upper(),
-                    "amount": D(row["amount"]),
-                    "avg_cost_cad": D(row["avg_cost_cad"])
-                })
+            if not row: continue
+            rows_append({
+                "ticker": row[i_tic].strip().upper(),
+                "shares_e6": to_scaled(row[i_sh], SHARE_DP),
+                "cost_e4": to_scaled(row[i_cost], PRICE_DP),
+                "currency": row[i_cur].strip().upper()
+            })
     return rows
 
+def _load_holdings_crypto(holdings_path):
+    rows = []
+    rows_append = rows.append
+    with open(holdings_path, newline="") as f:
+        r = csv.reader(f)
+        i_sym, i_amt, i_cost = _header_index(r, ("symbol","amount","avg_cost_cad"), "holdings")
+        for row in r:
+            if not row: continue
+            rows_append({
+                "symbol": row[i_sym].strip().upper(),
+                "amount_e6": to_scaled(row[i_amt], SHARE_DP),
+                "cost_e4": to_scaled(row[i_cost], PRICE_DP)
+            })
+    return rows
+
+def load_holdings(holdings_path, asset):
+    if asset == "equity":
+        return _load_holdings_equity(holdings_path)
+    return _load_holdings_crypto(holdings_path)
+
 def index_holdings(rows, key):
     return {row[key]: row for row in rows}
 
-def apply_equity(holdings, trades, fills):
-    hidx = index_holdings(holdings, "ticker")
-    # group fills by (action,ticker)
+def _apply(holdings, trades, fills, key, hqty, fqty, noun, currency):
+    """Shared apply loop; the asset-specific field names come in as arguments.
+
+    key: "ticker"/"symbol"; hqty/fqty: quantity field on holdings/fills rows;
+    noun: "qty"/"amount" for messages; currency: equity rows carry a currency.
+    """
+    hidx = index_holdings(holdings, key)
+    order = sorted(hidx)  # kept sorted as keys come and go, so the return needs no sort
+    # group fills by (action,key)
     fidx = {}
     for f in fills:
-        k = (f["action"], f["ticker"])
+        k = (f["action"], f[key])
         fidx.setdefault(k, []).append(f)
 
     for t in trades:
-        k = ("qty", "ticker")
-        action, ticker, qty = t["action"], t["ticker"], D(t["qty"])
-        fills_here = fidx.get((action, ticker), [])
+        action, sym, qty = t["action"], t[key], t["qty_e6"]
+        assert type(qty) is int, "load_trades must hand over scaled ints"
+        fills_here = fidx.get((action, sym), [])
         if not fills_here:
-            die(f"no fill provided for trade {action} {ticker}")
+            die(f"no fill provided for trade {action} {sym}")
 
-        # If multiple partial fills exist, weight the average fill price
-        total_qty = sum((f["qty"] for f in fills_here), D(0))
+        # If multiple partial fills exist, weight the average fill price (buys only;
+        # a sell leaves avg_cost alone). fill_cost = sum(qty*price) at 10**(6+px_dp),
+        # px_dp being the finest fill price here (4 unless a fill has more digits);
+        # dividing by shares_e6 * 10**(px_dp-4) lands back on 1e4
+        total_qty = fill_cost = 0
+        if action == "buy":
+            px_dp = max(f["price_dp"] for f in fills_here)
+            for f in fills_here:
+                q = f[fqty]
+                total_qty += q
+                fill_cost += q * f["price_n"] * 10**(px_dp - f["price_dp"])
+        else:
+            for f in fills_here:
+                total_qty += f[fqty]
         if total_qty != qty:
-            die(f"fills qty {total_qty} != trade qty {qty} for {ticker}")
-
-        avg_fill_price = sum((f["qty"]*f["fill_price"] for f in fills_here), D(0)) / qty
+            die(f"fills {noun} {fmt_scaled(total_qty, SHARE_DP)} != trade qty {fmt_scaled(qty, SHARE_DP)} for {sym}")
 
+        row = hidx.get(sym)
         if action == "buy":
-            row = hidx.get(ticker)
             if row:
-                if any(f["currency"] != row["currency"] for f in fills_here):
-                    die(f"currency mismatch for {ticker}")
-                new_sh = row["shares"] + qty
-                new_cost = ((row["shares"] * row["avg_cost"]) + (qty * avg_fill_price)) / new_sh
-                row["shares"]   = round_shares(new_sh)
-                row["avg_cost"] = round_price(new_cost)
+                if currency:
+                    cur = row["currency"]
+                    for f in fills_here:
+                        if f["currency"] != cur:
+                            die(f"currency mismatch for {sym}")
+                up = 10**(px_dp - PRICE_DP)
+                new_sh = row[hqty] + qty
+                row["cost_e4"] = half_up(row[hqty]*row["cost_e4"]*up + fill_cost, new_sh*up)
+                row[hqty]      = new_sh
             else:
-                currency = fills_here[0]["currency"]
-                hidx[ticker] = {
-                    "ticker": ticker,
-                    "shares": round_shares(qty),
-                    "avg_cost": round_price(avg_fill_price),
-                    "currency": currency
-                }
+                bisect.insort(order, sym)
+                row = hidx[sym] = {key: sym, hqty: qty, "cost_e4": half_up(fill_cost, qty * 10**(px_dp - PRICE_DP))}
+                if currency:
+                    row["currency"] = fills_here[0]["currency"]
         else:  # sell
-            row = hidx.get(ticker)
             if not row:
-                die(f"selling non-existent holding {ticker}")
-            if qty > row["shares"]:
-                die(f"sell qty {qty} exceeds holding {row['shares']} for {ticker}")
-            new_sh = row["shares"] - qty
-            row["shares"] = round_shares(new_sh)
+                die(f"selling non-existent holding {sym}")
+            if qty > row[hqty]:
+                die(f"sell {noun} {fmt_scaled(qty, SHARE_DP)} exceeds holding {fmt_scaled(row[hqty], SHARE_DP)} for {sym}")
+            row[hqty] -= qty
             # avg_cost stays as original for remaining shares; remove row if zero
-            if row["shares"] == 0:
-                del hidx[ticker]
+            if row[hqty] == 0:
+                del hidx[sym]
+                order.remove(sym)
 
     # return as list in stable order
-    return sorted(hidx.values(), key=lambda r: r["ticker"])
+    return [hidx[k] for k in order]
 
-def apply_crypto(holdings, trades, fills):
-    hidx = index_holdings(holdings, "symbol")
-    fidx = {}
-    for f in fills:
-        k = (f["action"], f["symbol"])
-        fidx.setdefault(k, []).append(f)
+def apply_equity(holdings, trades, fills):
+    return _apply(holdings, trades, fills, "ticker", "shares_e6", "qty_e6", "qty", currency=True)
 
-    for t in trades:
-        action, symbol, amt = t["action"], t["symbol"], D(t["qty"])  # qty is "amount"
-        fills_here = fidx.get((action, symbol), [])
-        if not fills_here:
-            die(f"no fill provided for trade {action} {symbol}")
+def apply_crypto(holdings, trades, fills):
+    # trade "qty" is the coin amount
+    return _apply(holdings, trades, fills, "symbol", "amount_e6", "amount_e6", "amount", currency=False)
 
-        total_amt = sum((f["amount"] for f in fills_here), D(0))
-        if total_amt != amt:
-            die(f"fills amount {total_amt} != trade qty {amt} for {symbol}")
+def verify_decimal(holdings_path, trades_path, fills_path, updated, asset):
+    """--strict: replay the trades in Decimal arithmetic straight from the input files
+    (not the scaled ints, so parse-time rounding can't hide) and compare the result."""
+    if asset == "equity":
+        key, hq, hc, fq, fp = "ticker", "shares", "avg_cost", "qty", "fill_price"
+        qkey = "shares_e6"
+    else:
+        key, hq, hc, fq, fp = "symbol", "amount", "avg_cost_cad", "amount", "fill_price_cad"
+        qkey = "amount_e6"
 
-        avg_fill_price = sum((f["amount"]*f["fill_price_cad"] for f in fills_here), D(0)) / amt
+    with open(holdings_path, newline="") as f:
+        hidx = {r[key].strip().upper(): (D(r[hq]), D(r[hc])) for r in csv.DictReader(f)}
+    fidx = {}
+    with open(fills_path, newline="") as f:
+        for r in csv.DictReader(f):
+            fidx.setdefault((r["action"].strip().lower(), r[key].strip().upper()), []).append((D(r[fq]), D(r[fp])))
 
+    for t in _json_loads(Path(trades_path).read_bytes())["trades"]:
+        action, sym, qty = t["action"].lower(), str(t[key]).strip().upper(), D(t["qty"])
+        fills_here = fidx[(action, sym)]
         if action == "buy":
-            row = hidx.get(symbol)
-            if row:
-                new_amt = row["amount"] + amt
-                new_cost = ((row["amount"] * row["avg_cost_cad"]) + (amt * avg_fill_price)) / new_amt
-                row["amount"]       = round_shares(new_amt)
-                row["avg_cost_cad"] = round_price(new_cost)
+            avg_fill_price = sum((q * px for q, px in fills_here), D(0)) / qty
+            if sym in hidx:
+                sh, cost = hidx[sym]
+                new_sh = sh + qty
+                hidx[sym] = (round_shares(new_sh), round_price(((sh * cost) + (qty * avg_fill_price)) / new_sh))
             else:
-                hidx[symbol] = {
-                    "symbol": symbol,
-                    "amount": round_shares(amt),
-                    "avg_cost_cad": round_price(avg_fill_price)
-                }
-        else:  # sell
-            row = hidx.get(symbol)
-            if not row:
-                die(f"selling non-existent holding {symbol}")
-            if amt > row["amount"]:
-                die(f"sell amount {amt} exceeds holding {row['amount']} for {symbol}")
-            new_amt = row["amount"] - amt
-            row["amount"] = round_shares(new_amt)
-            if row["amount"] == 0:
-                del hidx[symbol]
+                hidx[sym] = (round_shares(qty), round_price(avg_fill_price))
+        else:
+            sh = round_shares(hidx[sym][0] - qty)
+            if sh == 0:
+                del hidx[sym]
+            else:
+                hidx[sym] = (sh, hidx[sym][1])
 
-    return sorted(hidx.values(), key=lambda r: r["symbol"])
+    # compared as values: untouched rows keep their input spelling in the replay
+    expected = [(sym, sh, cost) for sym, (sh, cost) in sorted(hidx.items())]
+    got = [(r[key], Decimal(fmt_scaled(r[qkey], SHARE_DP)), Decimal(fmt_scaled(r["cost_e4"], PRICE_DP))) for r in updated]
+    if got != expected:
+        fmt = lambda rows: [(k, str(a), str(b)) for k, a, b in rows]
+        die(f"--strict: int result diverges from Decimal replay:\n  int:     {fmt(got)}\n  Decimal: {fmt(expected)}")
 
 def write_holdings(rows, out_path, asset):
-    # backup existing file if overwriting
-    if Path(out_path).exists():
-        ts = time.strftime("%Y%m%d-%H%M%S")
-        backup = f"{out_path}.bak-{ts}"
-        Path(out_path).replace(backup)
-        print(f"Backed up previous holdings to {backup}")
-
+    # csv.writer.writerows already serializes in C; feed it lazily so no second copy of
+    # the holdings is built (pandas.to_csv would cost more in import time than it saves here)
     if asset == "equity":
         fieldnames = ["ticker","shares","avg_cost","currency"]
+        out = ((r["ticker"], fmt_scaled(r["shares_e6"], SHARE_DP), fmt_scaled(r["cost_e4"], PRICE_DP), r["currency"])
+               for r in rows)
     else:
         fieldnames = ["symbol","amount","avg_cost_cad"]
+        out = ((r["symbol"], fmt_scaled(r["amount_e6"], SHARE_DP), fmt_scaled(r["cost_e4"], PRICE_DP))
+               for r in rows)
+
+    # write next to the target, then swap it in atomically
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(fieldnames)
+        w.writerows(out)
 
-    with open(out_path, "w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        for row in rows:
-            w.writerow({k: str(v) for k,v in row.items()})
+    # backup existing file if overwriting: a hardlink keeps the old inode, no copy
+    if Path(out_path).exists():
+        ts = time.strftime("%Y%m%d-%H%M%S")
+        backup = f"{out_path}.bak-{ts}"
+        try:
+            os.link(out_path, backup)
+        except OSError:  # no hardlink support (FAT, cross-device, some Windows setups)
+            shutil.copy2(out_path, backup)
+        print(f"Backed up previous holdings to {backup}")
+    os.replace(tmp, out_path)
 
 def main():
     ap = argparse.ArgumentParser(description="Apply executed trades to holdings (equity/crypto)")
@@ -230,6 +354,7 @@ def main():
     ap.add_argument("--trades", required=True)
     ap.add_argument("--fills", required=True)
     ap.add_argument("--out", required=True, help="Output CSV (will overwrite; backup made)")
+    ap.add_argument("--strict", action="store_true", help="Cross-check the result against a Decimal replay")
     args = ap.parse_args()
 
     trades = load_trades(args.trades, args.asset)
@@ -237,9 +362,19 @@ def main():
     holdings = load_holdings(args.holdings, args.asset)
 
     if args.asset == "equity":
-        updated = apply_equity(holdings, trades, fills)
+        apply_c, apply_py = apply_equity_c, apply_equity
     else:
-        updated = apply_crypto(holdings, trades, fills)
+        apply_c, apply_py = apply_crypto_c, apply_crypto
+    if apply_c is not None:
+        try:
+            updated = apply_c(holdings, trades, fills)
+        except ValueError as e:
+            die(str(e))
+    else:
+        updated = apply_py(holdings, trades, fills)
+
+    if args.strict:
+        verify_decimal(args.holdings, args.trades, args.fills, updated, args.asset)
 
     write_holdings(updated, args.out, args.asset)
     print(f"Wrote updated holdings → {args.out}")
@@ -0,0 +1,181 @@
+# Helpers shared by screener_step1.py and screener_step1_5.py: Wikipedia fetch/cache and the weekly snapshot
+
+import json
+import re
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+try:  # optional: compiled per-ticker snapshot (pip install numba)
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+UA = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15"}
+
+# one keep-alive session shared by all Wikipedia fetches (retries reuse the TLS connection)
+SESSION = requests.Session()
+SESSION.headers.update(UA)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+# constituent pages change a few times a year; keep a revalidated copy
+CACHE_DIR = Path.home() / ".cache" / "stocks"
+SP500_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+TSX60_URL = "https://en.wikipedia.org/wiki/S%26P/TSX_60"
+
+def fetch(url: str, max_retries: int = 3, backoff: float = 1.0, headers: dict = None) -> requests.Response:
+    """GET with retries; a 304 counts as success for conditional requests."""
+    last_err = None
+    for i in range(max_retries):
+        try:
+            r = SESSION.get(url, headers=headers, timeout=20)
+            if r.status_code in (200, 304):
+                return r
+            last_err = RuntimeError(f"HTTP {r.status_code}")
+        except Exception as e:
+            last_err = e
+        time.sleep(backoff * (2 ** i))
+    raise last_err if last_err else RuntimeError("Unknown fetch error")
+
+def cached_symbols(url: str, name: str, parse: Callable[[str], List[str]]) -> List[str]:
+    """Symbols parsed from a Wikipedia page, cached under CACHE_DIR.
+
+    The page is revalidated with If-None-Match / If-Modified-Since; on a 304
+    the previously parsed list is returned without running pd.read_html.
+    """
+    html_path = CACHE_DIR / f"{name}.html"
+    meta_path = CACHE_DIR / f"{name}.meta.json"
+    syms_path = CACHE_DIR / f"{name}.json"
+
+    headers = {}
+    if html_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    r = fetch(url, headers=headers)
+    if r.status_code == 304:
+        if syms_path.exists():
+            return json.loads(syms_path.read_text())
+        html = html_path.read_text()
+    else:
+        html = r.text
+
+    syms = parse(html)
+    # write the list before the validators so a 304 never pairs with a stale list
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    html_path.write_text(html)
+    syms_path.write_text(json.dumps(syms))
+    if r.status_code == 200:
+        meta_path.write_text(json.dumps({
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }))
+    return syms
+
+# plausible ticker: A–Z start, then A–Z/0–9/./-, short
+TICKER_RE = re.compile(r"^[A-Z][A-Z0-9.\-]{0,6}$")
+
+def detect_ticker_column(tables: List[pd.DataFrame]) -> Optional[List[str]]:
+    """Unique values of the first column that looks like a ticker list, or None.
+
+    Detects by content (robust to header changes), then falls back to a column
+    literally named Symbol/Ticker.
+    """
+    for tbl in tables:
+        # numeric columns can't hold tickers; skip the astype(str) + regex pass on them
+        for col in tbl.select_dtypes(include=["object", "string"]).columns:
+            vals = tbl[col].astype(str).str.strip().dropna()
+            if len(vals) == 0:
+                continue
+            matches = vals[vals.str.match(TICKER_RE)]
+            # require at least ~15 plausible symbols and >50% of non-null rows matching
+            if len(matches) >= 15 and len(matches) / max(1, len(vals)) > 0.5:
+                return matches.unique().tolist()
+
+    for tbl in tables:
+        for name in tbl.columns:
+            if str(name).strip().lower() in ("symbol", "ticker", "ticker symbol"):
+                best = tbl[name].astype(str).str.strip().unique().tolist()
+                if best:
+                    return best
+    return None
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _snapshot_nb(close, volume, valid):
+        # matches the NumPy path below on every ticker with 6+ bars (the rest are
+        # dropped by the caller); rounding stays with the caller (np.round support
+        # in numba is partial)
+        ndays, n = close.shape
+        last = np.empty(n)
+        pct = np.empty(n)
+        vol5 = np.empty(n)
+        for j in prange(n):
+            seen = 0
+            vsum = 0.0
+            last[j] = np.nan
+            ref = np.nan
+            # walk back over this ticker's own bars, skipping gaps
+            for i in range(ndays - 1, -1, -1):
+                if not valid[i, j]:
+                    continue
+                c = close[i, j]
+                v = volume[i, j]
+                if seen == 0:
+                    last[j] = c
+                if seen < 5:
+                    vsum += v
+                seen += 1
+                if seen == 6:
+                    ref = c
+                    break
+            pct[j] = (last[j] / ref - 1) * 100.0 if seen >= 6 else np.nan
+            vol5[j] = vsum / 5 if seen >= 5 else np.nan
+        return last, pct, vol5
+else:
+    _snapshot_nb = None
+
+def py_round(a: np.ndarray, ndigits: int) -> np.ndarray:
+    """Element-wise built-in round() on the float values, as round(float(...), 2) did per
+    ticker; np.round scales by 10**ndigits first and can land on the other side of a
+    tie (474.195 -> 474.2 vs 474.19)."""
+    return np.array([round(v, ndigits) for v in a.tolist()], dtype="float64")
+
+# candidates_raw.csv row layout; float64 so the CSV keeps the same 2-dp text as before,
+# and ticker as object so a long symbol is never cut to a fixed width
+SNAPSHOT_DTYPE = [("ticker", "O"), ("close", "f8"), ("pct_change_1w", "f8"), ("avg_volume_5d", "i8")]
+
+def valid_bars(hist: pd.DataFrame) -> np.ndarray:
+    """(days, tickers) mask of bars with every OHLCV field present, i.e. the rows
+    hist[t].dropna() kept; columns follow hist["Close"] (group_by="column" layout)."""
+    valid = hist.notna().T.groupby(level=1).all().T
+    return valid.reindex(columns=hist["Close"].columns, fill_value=False).to_numpy()
+
+def weekly_snapshot(close: np.ndarray, volume: np.ndarray, valid: np.ndarray):
+    """Last close, 1-week % change and 5-day avg volume for every column of (days, tickers).
+
+    Only bars marked in valid (see valid_bars) count, and each ticker skips its own
+    gaps (NYSE and TSX holidays differ); pct is NaN where a ticker has fewer than 6 bars.
+    """
+    if _snapshot_nb is not None:
+        return _snapshot_nb(close, volume, valid)
+    # stable sort on the mask pushes each column's gaps to the top, keeping bar order
+    order = np.argsort(valid, axis=0, kind="stable")
+    close = np.take_along_axis(close, order, axis=0)
+    volume = np.take_along_axis(volume, order, axis=0)
+    n = close.shape[0]
+    enough = valid.sum(axis=0) >= 6
+    last = close[-1]
+    ref = close[-6] if n >= 6 else np.full_like(last, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct = np.where(enough, (last / ref - 1) * 100.0, np.nan)
+        vol5 = volume[-5:].mean(axis=0)
+    return last, pct, vol5
@@ -11,37 +11,28 @@ import datetime as dt
 import io
 import json
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+import numpy as np
 import pandas as pd
-import requests
 import yfinance as yf
 
-UA = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15"}
+from screener_common import (
+    SNAPSHOT_DTYPE, SP500_URL, TSX60_URL, cached_symbols, detect_ticker_column,
+    py_round, valid_bars, weekly_snapshot,
+)
 
-# ----- fetch helpers -----
-def fetch_html(url: str, max_retries: int = 3, backoff: float = 1.0) -> str:
-    last_err = None
-    for i in range(max_retries):
-        try:
-            r = requests.get(url, headers=UA, timeout=20)
-            if r.status_code == 200:
-                return r.text
-            last_err = RuntimeError(f"HTTP {r.status_code}")
-        except Exception as e:
-            last_err = e
-        time.sleep(backoff * (2 ** i))
-    raise last_err if last_err else RuntimeError("Unknown fetch error")
-
-def get_sp500_from_wikipedia() -> List[str]:
-    html = fetch_html("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")
-    tables = pd.read_html(io.StringIO(html))
+def parse_sp500(html: str) -> List[str]:
+    tables = pd.read_html(io.StringIO(html), flavor="lxml")
     df = tables[0]
     symcol = "Symbol" if "Symbol" in df.columns else [c for c in df.columns if "symbol" in str(c).lower()][0]
     syms = df[symcol].astype(str).str.strip().tolist()
     return syms
 
+def get_sp500_from_wikipedia() -> List[str]:
+    return cached_symbols(SP500_URL, "sp500", parse_sp500)
+
 def get_sp500() -> List[str]:
     try:
         return get_sp500_from_wikipedia()
@@ -53,34 +44,14 @@ def get_sp500() -> List[str]:
             raise RuntimeError(f"Could not retrieve S&P 500 tickers: {e2}")
 
 def get_tsx60() -> List[str]:
-    html = fetch_html("https://en.wikipedia.org/wiki/S%26P/TSX_60")
-    tables = pd.read_html(io.StringIO(html))
+    return cached_symbols(TSX60_URL, "tsx60", parse_tsx60)
+
+def parse_tsx60(html: str) -> List[str]:
+    tables = pd.read_html(io.StringIO(html), flavor="lxml")
     if not tables:
         raise RuntimeError("No tables on TSX-60 page")
-    # detect column by content (robust to header changes)
-    ticker_re = re.compile(r"^[A-Z][A-Z0-9.\-]{0,6}$")
-    best = None
-    for tbl in tables:
-        for col in tbl.columns:
-            series = tbl[col].astype(str).str.strip()
-            vals = series.dropna()
-            if len(vals) == 0:
-                continue
-            matches = vals[vals.str.match(ticker_re)]
-            if len(matches) >= 15 and len(matches) / max(1, len(vals)) > 0.5:
-                best = matches.unique().tolist()
-                break
-        if best:
-            break
-    if not best:
-        # fallback literal header names if heuristic missed
-        for tbl in tables:
-            for name in tbl.columns:
-                if str(name).strip().lower() in ("symbol", "ticker", "ticker symbol"):
-                    best = tbl[name].astype(str).str.strip().unique().tolist()
-                    break
-            if best:
-                break
+    # detect column by content (robust to header changes), else a literal Symbol/Ticker header
+    best = detect_ticker_column(tables)
     if not best:
         raise RuntimeError("Couldn't find a plausible Symbol/Ticker column for TSX-60")
     # add .TO (we’ll normalize to Yahoo format later)
@@ -122,15 +93,42 @@ def normalize_symbol(sym: str) -> str:
             return f"{base}-{cls}.TO"
     return sym
 
-# ----- calc helpers -----
-def pct_1w(series: pd.Series) -> float:
-    if len(series) < 6:
-        return float("nan")
-    return (series.iloc[-1] / series.iloc[-6] - 1) * 100.0
+# ----- price history -----
+def hist_cache_path(start: dt.date, end: dt.date) -> str:
+    return f"candidates_hist_{start.isoformat()}_{end.isoformat()}.parquet"
+
+def load_history(universe: List[str], start: dt.date, end: dt.date) -> pd.DataFrame:
+    """Daily OHLCV from yf.download(group_by="column"), i.e. (field, ticker) columns.
+
+    Cached as parquet per date range; reruns with the same universe skip the download.
+    """
+    cache = hist_cache_path(start, end)
+    try:
+        cached = pd.read_parquet(cache)
+        if set(cached.columns.get_level_values(1)) == set(universe):
+            print(f"Using cached history {cache}")
+            return cached
+    except Exception:
+        pass  # no cache yet (or no parquet engine installed)
 
+    print(f"Downloading history for {len(universe)} tickers…")
+    hist = yf.download(
+        universe, start=start, end=end,
+        interval="1d", group_by="column",
+        auto_adjust=True, threads=True
+    )
+    try:
+        hist.to_parquet(cache)
+    except Exception as e:
+        print("Could not cache history:", e)
+    return hist
+
+# ----- calc helpers -----
 def main():
-    sp500 = get_sp500()
-    tsx60 = get_tsx60()
+    # both constituent pages are network-bound; fetch them side by side
+    with ThreadPoolExecutor(2) as ex:
+        f_sp500, f_tsx60 = ex.submit(get_sp500), ex.submit(get_tsx60)
+        sp500, tsx60 = f_sp500.result(), f_tsx60.result()
 
     # normalize to Yahoo symbols up front
     universe = sorted({normalize_symbol(s) for s in (sp500 + tsx60)})
@@ -138,34 +136,24 @@ def main():
     end = dt.date.today()
     start = end - dt.timedelta(days=14)  # ~10 trading days
 
-    print(f"Downloading history for {len(universe)} tickers…")
-    hist = yf.download(
-        universe, start=start, end=end,
-        interval="1d", group_by="ticker",
-        auto_adjust=True, threads=True
+    hist = load_history(universe, start, end)
+    # group_by="column": hist["Close"] / hist["Volume"] are flat (days × tickers) frames
+    closes = hist["Close"]
+    last, pct, vol5 = weekly_snapshot(
+        closes.to_numpy(dtype="float64"),
+        hist["Volume"].to_numpy(dtype="float64"),
+        valid_bars(hist),
     )
+    arr = np.empty(len(closes.columns), dtype=SNAPSHOT_DTYPE)
+    arr["ticker"] = closes.columns.to_numpy(dtype=object)
+    arr["close"] = py_round(last, 2)
+    arr["pct_change_1w"] = np.round(pct, 2)  # round(np.float64) already rounded this way
+    arr["avg_volume_5d"] = np.nan_to_num(vol5).astype("int64")
+    arr = arr[~np.isnan(pct)]  # fewer than 6 bars
+    df_all = pd.DataFrame(arr).sort_values("pct_change_1w", ascending=False)
+    kept = set(df_all["ticker"])
+    failed = [(t, "too_short") for t in universe if t not in kept]
 
-    rows = []
-    failed = []
-    for t in universe:
-        try:
-            df = hist[t].dropna()
-            if len(df) < 6:
-                failed.append((t, "too_short"))
-                continue
-            close_today = float(df["Close"].iloc[-1])
-            change = pct_1w(df["Close"])
-            avg_vol_5 = float(df["Volume"].tail(5).mean())
-            rows.append({
-                "ticker": t,
-                "close": round(close_today, 2),
-                "pct_change_1w": round(change, 2),
-                "avg_volume_5d": int(avg_vol_5),
-            })
-        except Exception as e:
-            failed.append((t, str(e)))
-
-    df_all = pd.DataFrame(rows).sort_values("pct_change_1w", ascending=False)
     df_all.to_csv("candidates_raw.csv", index=False)
     print(f"Wrote candidates_raw.csv with {len(df_all)} tickers")
     if failed:
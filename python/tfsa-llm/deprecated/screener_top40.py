@@ -48,7 +48,7 @@ def fetch_html(url: str, max_retries: int = 3, backoff: float = 1.0) -> str:
 
 def get_sp500_from_wikipedia() -> List[str]:
     html = fetch_html("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")
-    tables = pd.read_html(io.StringIO(html))
+    tables = pd.read_html(io.StringIO(html), flavor="lxml")
     df = tables[0]
     symcol = "Symbol" if "Symbol" in df.columns else [c for c in df.columns if "symbol" in str(c).lower()][0]
     return df[symcol].astype(str).str.strip().tolist()
@@ -65,7 +65,7 @@ def get_sp500() -> List[str]:
 
 def get_tsx60() -> List[str]:
     html = fetch_html("https://en.wikipedia.org/wiki/S%26P/TSX_60")
-    tables = pd.read_html(io.StringIO(html))
+    tables = pd.read_html(io.StringIO(html), flavor="lxml")
     if not tables:
         raise RuntimeError("No tables on TSX-60 page")
     # Heuristic: detect the ticker column by content
@@ -15,27 +15,53 @@
 # - Holdings math is deterministic (weighted-average cost). Sells reduce qty.
 # - Files are created if missing; previous holdings are backed up with a .bak-<timestamp>.
 
-import json, csv, sys, os, time
+import bisect, io, json, csv, sys, os, shutil, time
+from contextlib import contextmanager
+from operator import itemgetter
 from pathlib import Path
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import date, timedelta
 
-D = lambda x: Decimal(str(x))
+try:  # C JSON parser/writer when available
+    import orjson
+    _loads = orjson.loads
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    _loads = json.loads
+    # UTF-8 like orjson, so the file bytes don't depend on which one is installed
+    # (only float spelling can differ: json writes 1e-05 where orjson writes 0.00001)
+    _dumps = lambda obj: json.dumps(obj, indent=2, ensure_ascii=False).encode()
+
+# Decimal passes through untouched; anything else goes via str so floats don't pick up binary noise
+def D(x, _D=Decimal, _s=str): return x if type(x) is _D else _D(_s(x))
 QTY_PREC = Decimal("0.000000")   # 6 dp for shares/coins
 PX_PREC  = Decimal("0.0001")     # 4 dp for avg_cost; entries store raw floats
 
+class LedgerError(Exception):
+    """Bad input or inconsistent holdings/entries files."""
+
 # ---------- IO helpers
+_ensured_dirs = set()  # parents already created/confirmed this run
+
 def ensure_parent(path: Path):
-    if path.parent and not path.parent.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
+    d = path.parent
+    if d in _ensured_dirs:
+        return
+    d.mkdir(parents=True, exist_ok=True)
+    _ensured_dirs.add(d)
 
 def backup_file(path: Path):
-    if path.exists():
-        ts = time.strftime("%Y%m%d-%H%M%S")
-        path.rename(path.with_name(path.name + f".bak-{ts}"))
+    # hardlink: the old inode stays put as the .bak while the new file is swapped in
+    bak = path.with_name(path.name + f".bak-{time.strftime('%Y%m%d-%H%M%S')}")
+    try:
+        os.link(path, bak)
+    except FileNotFoundError:
+        pass
+    except OSError:  # no hardlink support (FAT, cross-device, some Windows setups)
+        shutil.copy2(path, bak)
 
-def rounded_qty(x):  return D(x).quantize(QTY_PREC,  rounding=ROUND_HALF_UP)
-def rounded_px(x):   return D(x).quantize(PX_PREC,   rounding=ROUND_HALF_UP)
+def rounded_qty(x, _q=QTY_PREC, _r=ROUND_HALF_UP):  return D(x).quantize(_q, rounding=_r)
+def rounded_px(x, _q=PX_PREC, _r=ROUND_HALF_UP):    return D(x).quantize(_q, rounding=_r)
 
 def clear(): 
     try:
@@ -59,73 +85,128 @@ def defaults_for(asset: str):
 def init_files_if_needed(holdings: Path, entries: Path, asset: str):
     ensure_parent(holdings)
     ensure_parent(entries)
-    if not holdings.exists():
-        with holdings.open("w", newline="") as f:
+    # "x" creates only if missing, so no separate exists() check
+    try:
+        with holdings.open("x", newline="", encoding="utf-8") as f:
             if asset == "equity":
                 csv.writer(f).writerow(["ticker","shares","avg_cost","currency"])
             else:
                 csv.writer(f).writerow(["symbol","amount","avg_cost_cad"])
-    if not entries.exists():
-        entries.write_text("[]")
+    except FileExistsError:
+        pass
+    try:
+        with entries.open("x") as f:
+            f.write("[]")
+    except FileExistsError:
+        pass
 
 # ---------- holdings load/save
 def load_holdings(holdings: Path, asset: str):
     rows = []
-    if not holdings.exists():
+    try:
+        f = holdings.open(newline="", encoding="utf-8")
+    except FileNotFoundError:
         return rows
-    with holdings.open(newline="") as f:
-        r = csv.DictReader(f)
+    with f:
+        r = csv.reader(f)
         if asset == "equity":
             req = ("ticker","shares","avg_cost","currency")
         else:
             req = ("symbol","amount","avg_cost_cad")
-        miss = [c for c in req if c not in r.fieldnames]
+        header = next(r, [])
+        miss = [c for c in req if c not in header]
         if miss:
-            print(f"ERROR: holdings CSV missing columns: {miss}"); sys.exit(1)
-        for row in r:
-            if asset == "equity":
+            raise LedgerError(f"holdings CSV missing columns: {miss}")
+        # fixed schema: index by position instead of building a dict per row
+        idx = [header.index(c) for c in req]
+        if asset == "equity":
+            i_tic, i_sh, i_cost, i_cur = idx
+            for row in r:
+                if not row: continue
                 rows.append({
-                    "ticker": row["ticker"].strip().upper(),
-                    "shares": D(row["shares"]),
-                    "avg_cost": D(row["avg_cost"]),
-                    "currency": row["currency"].strip().upper()
+                    "ticker": row[i_tic].strip().upper(),
+                    "shares": D(row[i_sh]),
+                    "avg_cost": D(row[i_cost]),
+                    "currency": row[i_cur].strip().upper()
                 })
-            else:
+        else:
+            i_sym, i_amt, i_cost = idx
+            for row in r:
+                if not row: continue
                 rows.append({
-                    "symbol": row["symbol"].strip().upper(),
-                    "amount": D(row["amount"]),
-                    "avg_cost_cad": D(row["avg_cost_cad"])
+                    "symbol": row[i_sym].strip().upper(),
+                    "amount": D(row[i_amt]),
+                    "avg_cost_cad": D(row[i_cost])
                 })
     return rows
 
 def save_holdings(holdings: Path, rows, asset: str):
+    if asset == "equity":
+        fields = ["ticker","shares","avg_cost","currency"]
+    else:
+        fields = ["symbol","amount","avg_cost_cad"]
+    # build the whole CSV in memory and hit the file once; csv.writer str()s the Decimals
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(fields)
+    w.writerows(map(itemgetter(*fields), rows))  # already in key order from apply_*
+    # write next to the target, then swap it in atomically
+    tmp = holdings.with_name(holdings.name + ".tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        f.write(buf.getvalue())
     backup_file(holdings)
-    with holdings.open("w", newline="") as f:
-        if asset == "equity":
-            fields = ["ticker","shares","avg_cost","currency"]
-        else:
-            fields = ["symbol","amount","avg_cost_cad"]
-        w = csv.DictWriter(f, fieldnames=fields)
-        w.writeheader()
-        for r in sorted(rows, key=lambda x: (x.get("ticker") or x.get("symbol"))):
-            out = dict(r)
-            # serialize Decimals
-            for k,v in out.items():
-                if isinstance(v, Decimal):
-                    out[k] = str(v)
-            w.writerow(out)
+    os.replace(tmp, holdings)
+
+@contextmanager
+def _open_holdings(holdings: Path, asset: str):
+    """Load holdings, yield the row list to update in place, save it back on a clean exit."""
+    rows = load_holdings(holdings, asset)
+    yield rows
+    save_holdings(holdings, rows, asset)
 
 # ---------- entries load/append
 def load_entries(entries: Path):
     try:
-        return json.loads(entries.read_text()) if entries.exists() else []
+        return _loads(entries.read_bytes())
+    except FileNotFoundError:
+        return []
     except Exception as e:
-        print(f"ERROR reading entries JSON: {e}"); sys.exit(1)
+        raise LedgerError(f"failed to read entries JSON: {e}") from e
 
 def append_entry(entries: Path, entry: dict):
+    if append_entry_in_place(entries, entry):
+        return
     data = load_entries(entries)
     data.append(entry)
-    entries.write_text(json.dumps(data, indent=2))
+    write_entries(entries, data)
+
+def write_entries(entries: Path, data: list):
+    with entries.open("wb") as f:
+        f.write(_dumps(data))
+
+def append_entry_in_place(entries: Path, entry: dict) -> bool:
+    # splice before the closing ] instead of re-reading the whole file;
+    # False means missing/empty/unexpected file, so do the full load/dump
+    try:
+        f = entries.open("r+b")
+    except FileNotFoundError:
+        return False
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= 2:
+            return False
+        f.seek(max(0, size - 64))
+        tail = f.read()
+        body = tail.rstrip()
+        if not body.endswith(b"]"):
+            return False
+        body = body[:-1].rstrip()
+        if not body.endswith(b"\n  }"):  # last element as written by indent=2
+            return False
+        f.seek(size - len(tail) + len(body))
+        f.write(b",\n" + _dumps([entry])[2:-2] + b"\n]")
+        f.truncate()
+    return True
 
 # ---------- week date helpers
 def nearest_sunday_today():
@@ -134,8 +215,12 @@ def nearest_sunday_today():
     return today if today.weekday() == 6 else (today + timedelta(days=(6 - today.weekday())))
 
 # ---------- math
+def index_by(rows, key): return dict(zip(map(itemgetter(key), rows), rows))
+
+# per-trade Decimal on purpose (don't vectorize): see the note on record_week.apply_equity
 def apply_equity(holdings_rows, trades):
-    idx = {r["ticker"]: r for r in holdings_rows}
+    idx = index_by(holdings_rows, "ticker")
+    order = sorted(idx)  # kept sorted as keys come and go, so saving needs no sort
     for t in trades:
         action = t["action"]; ticker = t["ticker"]; qty = D(t["qty"])
         px = D(t["unit_price"]); cur = t["currency"]
@@ -143,12 +228,14 @@ def apply_equity(holdings_rows, trades):
             row = idx.get(ticker)
             if row:
                 if row["currency"] != cur:
-                    raise ValueError(f"Currency mismatch for {ticker}")
-                new_sh = row["shares"] + qty
-                new_cost = ((row["shares"]*row["avg_cost"]) + (qty*px)) / new_sh
+                    raise LedgerError(f"Currency mismatch for {ticker}")
+                sh = row["shares"]
+                new_sh = sh + qty
+                new_cost = ((sh*row["avg_cost"]) + (qty*px)) / new_sh
                 row["shares"]   = rounded_qty(new_sh)
                 row["avg_cost"] = rounded_px(new_cost)
             else:
+                bisect.insort(order, ticker)
                 idx[ticker] = {
                     "ticker": ticker,
                     "shares": rounded_qty(qty),
@@ -157,26 +244,34 @@ def apply_equity(holdings_rows, trades):
                 }
         else:
             row = idx.get(ticker)
-            if not row: raise ValueError(f"Selling non-existent holding {ticker}")
-            if qty > row["shares"]:
-                raise ValueError(f"Sell qty {qty} exceeds holding {row['shares']} for {ticker}")
-            row["shares"] = rounded_qty(row["shares"] - qty)
-            if row["shares"] == 0: del idx[ticker]
-    return list(idx.values())
+            if not row: raise LedgerError(f"Selling non-existent holding {ticker}")
+            sh = row["shares"]
+            if qty > sh:
+                raise LedgerError(f"Sell qty {qty} exceeds holding {sh} for {ticker}")
+            left = rounded_qty(sh - qty)
+            if left == 0:
+                del idx[ticker]
+                order.remove(ticker)
+            else:
+                row["shares"] = left
+    return [idx[k] for k in order]
 
 def apply_crypto(holdings_rows, trades):
-    idx = {r["symbol"]: r for r in holdings_rows}
+    idx = index_by(holdings_rows, "symbol")
+    order = sorted(idx)  # kept sorted as keys come and go, so saving needs no sort
     for t in trades:
         action = t["action"]; sym = t["symbol"]; amt = D(t["qty"])
         px = D(t["unit_price"])
         if action == "buy":
             row = idx.get(sym)
             if row:
-                new_amt = row["amount"] + amt
-                new_cost = ((row["amount"]*row["avg_cost_cad"]) + (amt*px)) / new_amt
+                held = row["amount"]
+                new_amt = held + amt
+                new_cost = ((held*row["avg_cost_cad"]) + (amt*px)) / new_amt
                 row["amount"]       = rounded_qty(new_amt)
                 row["avg_cost_cad"] = rounded_px(new_cost)
             else:
+                bisect.insort(order, sym)
                 idx[sym] = {
                     "symbol": sym,
                     "amount": rounded_qty(amt),
@@ -184,12 +279,17 @@ def apply_crypto(holdings_rows, trades):
                 }
         else:
             row = idx.get(sym)
-            if not row: raise ValueError(f"Selling non-existent holding {sym}")
-            if amt > row["amount"]:
-                raise ValueError(f"Sell amount {amt} exceeds holding {row['amount']} for {sym}")
-            row["amount"] = rounded_qty(row["amount"] - amt)
-            if row["amount"] == 0: del idx[sym]
-    return list(idx.values())
+            if not row: raise LedgerError(f"Selling non-existent holding {sym}")
+            held = row["amount"]
+            if amt > held:
+                raise LedgerError(f"Sell amount {amt} exceeds holding {held} for {sym}")
+            left = rounded_qty(held - amt)
+            if left == 0:
+                del idx[sym]
+                order.remove(sym)
+            else:
+                row["amount"] = left
+    return [idx[k] for k in order]
 
 # ---------- TUI helpers (plain-text wizard)
 def prompt(msg, default=None, to_upper=False):
@@ -292,34 +392,28 @@ def main():
     if prompt_choice("Proceed to write files?", [("y","yes"),("n","no")]) != "y":
         print("Aborted. No changes written."); return
 
-    # Load holdings and apply
-    holds = load_holdings(holdings_path, asset)
+    # Load holdings, apply, and save (skipped if apply raises)
     try:
-        if asset == "equity":
-            updated = apply_equity(holds, trades)
-        else:
-            updated = apply_crypto(holds, trades)
-    except ValueError as e:
+        with _open_holdings(holdings_path, asset) as holds:
+            if asset == "equity":
+                holds[:] = apply_equity(holds, trades)
+            else:
+                holds[:] = apply_crypto(holds, trades)
+    except LedgerError as e:
         print(f"\nERROR: {e}\nNo changes written.")
         return
 
-    # Save holdings
-    save_holdings(holdings_path, updated, asset)
-
     # Append entries
-    entry_trades = []
     if asset == "equity":
-        for t in trades:
-            entry_trades.append({
-                "action": t["action"], "ticker": t["ticker"], "qty": float(t["qty"]),
-                "price": float(t["unit_price"]), "currency": t["currency"]
-            })
+        entry_trades = [{
+            "action": t["action"], "ticker": t["ticker"], "qty": float(t["qty"]),
+            "price": float(t["unit_price"]), "currency": t["currency"]
+        } for t in trades]
     else:
-        for t in trades:
-            entry_trades.append({
-                "action": t["action"], "symbol": t["symbol"], "qty": float(t["qty"]),
-                "price": float(t["unit_price"])
-            })
+        entry_trades = [{
+            "action": t["action"], "symbol": t["symbol"], "qty": float(t["qty"]),
+            "price": float(t["unit_price"])
+        } for t in trades]
     append_entry(entries_path, {
         "week_start": wk,
         "deposit_cad": round(float(dep), 2),
@@ -336,3 +430,5 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("\nInterrupted.")
+    except LedgerError as e:
+        print(f"ERROR: {e}"); sys.exit(1)
@@ -25,49 +25,87 @@ python3 record_week.py --asset crypto \
 
 # Interactive mode (no --fills): the script will prompt you trade-by-trade
 python3 record_week.py --asset equity --week 2025-09-14 --deposit 11 --holdings holdings.csv --entries data/entries.json
+
+# Backfill: one fills CSV per week, named by week start (2025-09-07.csv, 2025-09-14.csv, ...);
+# holdings and entries are written once at the end
+python3 record_week.py --asset equity --deposit 10 --batch-fills fills/ --holdings holdings.csv --entries data/entries.json
 """
 
-import argparse, csv, json, sys, os
+import argparse, bisect, csv, io, json, sys, os
+from contextlib import contextmanager
+from operator import itemgetter
 from pathlib import Path
 from decimal import Decimal, ROUND_HALF_UP
+from datetime import date
+
+try:  # C JSON parser/writer when available
+    import orjson
+    _loads = orjson.loads
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    _loads = json.loads
+    # UTF-8 like orjson, so the file bytes don't depend on which one is installed
+    # (only float spelling can differ: json writes 1e-05 where orjson writes 0.00001)
+    _dumps = lambda obj: json.dumps(obj, indent=2, ensure_ascii=False).encode()
+
+# Decimal passes through untouched; anything else goes via str so floats don't pick up binary noise
+def D(x, _D=Decimal, _s=str): return x if type(x) is _D else _D(_s(x))
 
-D = lambda x: Decimal(str(x))
+_Q_QTY   = Decimal("0.000000")
+_Q_PRICE = Decimal("0.0001")
 
-def round_qty(x):    return D(x).quantize(Decimal("0.000000"), rounding=ROUND_HALF_UP)
-def round_price(x):  return D(x).quantize(Decimal("0.0001"),   rounding=ROUND_HALF_UP)
+# quanta and rounding mode bound as defaults: LOAD_FAST instead of a global lookup per call
+def round_qty(x, _q=_Q_QTY, _r=ROUND_HALF_UP):      return D(x).quantize(_q, rounding=_r)
+def round_price(x, _q=_Q_PRICE, _r=ROUND_HALF_UP):  return D(x).quantize(_q, rounding=_r)
+
+class LedgerError(Exception):
+    """Bad input or inconsistent holdings; main() reports it and exits 1."""
 
 def die(msg): print(f"ERROR: {msg}", file=sys.stderr); sys.exit(1)
 
+_ensured_dirs = set()  # parents already created/confirmed this run
+
 def ensure_parent(path: Path):
-    if path.parent and not path.parent.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
+    d = path.parent
+    if d in _ensured_dirs:
+        return
+    d.mkdir(parents=True, exist_ok=True)
+    _ensured_dirs.add(d)
 
 # ---------- Load/save holdings
+def _header_index(r, req, what):
+    """Consume the header row and return the column position of each required field."""
+    header = next(r, [])
+    miss = [c for c in req if c not in header]
+    if miss: raise LedgerError(f"{what} CSV missing columns: {miss}")
+    return [header.index(c) for c in req]
+
 def load_holdings(path: Path, asset: str):
     rows = []
-    if not path.exists():
+    try:
+        f = path.open(newline="", encoding="utf-8")
+    except FileNotFoundError:
         return rows
-    with path.open(newline="") as f:
-        r = csv.DictReader(f)
+    with f:
+        r = csv.reader(f)
         if asset == "equity":
-            req = ("ticker","shares","avg_cost","currency")
-        else:
-            req = ("symbol","amount","avg_cost_cad")
-        miss = [c for c in req if c not in r.fieldnames]
-        if miss: die(f"holdings CSV missing columns: {miss}")
-        for row in r:
-            if asset == "equity":
+            i_tic, i_sh, i_cost, i_cur = _header_index(r, ("ticker","shares","avg_cost","currency"), "holdings")
+            for row in r:
+                if not row: continue
                 rows.append({
-                    "ticker": row["ticker"].strip().upper(),
-                    "shares": D(row["shares"]),
-                    "avg_cost": D(row["avg_cost"]),
-                    "currency": row["currency"].strip().upper()
+                    "ticker": row[i_tic].strip().upper(),
+                    "shares": D(row[i_sh]),
+                    "avg_cost": D(row[i_cost]),
+                    "currency": row[i_cur].strip().upper()
                 })
-            else:
+        else:
+            i_sym, i_amt, i_cost = _header_index(r, ("symbol","amount","avg_cost_cad"), "holdings")
+            for row in r:
+                if not row: continue
                 rows.append({
-                    "symbol": row["symbol"].strip().upper(),
-                    "amount": D(row["amount"]),
-                    "avg_cost_cad": D(row["avg_cost_cad"])
+                    "symbol": row[i_sym].strip().upper(),
+                    "amount": D(row[i_amt]),
+                    "avg_cost_cad": D(row[i_cost])
                 })
     return rows
 
@@ -77,62 +115,100 @@ def write_holdings(path: Path, rows, asset: str):
         fields = ["ticker","shares","avg_cost","currency"]
     else:
         fields = ["symbol","amount","avg_cost_cad"]
-    with path.open("w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fields)
-        w.writeheader()
-        for r in sorted(rows, key=lambda x: (x.get("ticker") or x.get("symbol"))):
-            out = {}
-            for k in fields:
-                v = r[k]
-                out[k] = str(v)
-            w.writerow(out)
+    # build the whole CSV in memory and hit the file once; csv.writer str()s the Decimals
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(fields)
+    w.writerows(map(itemgetter(*fields), rows))  # already in key order from apply_*
+    # write next to the target, then swap it in atomically
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+    os.replace(tmp, path)
+
+@contextmanager
+def _open_holdings(path: Path, asset: str):
+    """Load holdings, yield the row list to update in place, write it back on a clean exit."""
+    rows = load_holdings(path, asset)
+    yield rows
+    write_holdings(path, rows, asset)
 
 # ---------- Load/add site entries.json
 def load_entries(path: Path):
-    if not path.exists():
-        return []
     try:
-        data = json.loads(path.read_text())
-        if isinstance(data, list): return data
-        die("entries file exists but is not a JSON array")
+        data = _loads(path.read_bytes())
+    except FileNotFoundError:
+        return []
     except Exception as e:
-        die(f"failed to read entries JSON: {e}")
+        raise LedgerError(f"failed to read entries JSON: {e}") from e
+    if isinstance(data, list): return data
+    raise LedgerError("entries file exists but is not a JSON array")
 
 def append_entry(path: Path, entry: dict):
     ensure_parent(path)
+    if append_entry_in_place(path, entry):
+        return
     data = load_entries(path)
     data.append(entry)
-    path.write_text(json.dumps(data, indent=2))
+    write_entries(path, data)
+
+def write_entries(path: Path, data: list):
+    with path.open("wb") as f:
+        f.write(_dumps(data))
+
+def append_entry_in_place(path: Path, entry: dict) -> bool:
+    # splice before the closing ] instead of re-reading the whole file; writes the
+    # same bytes a full re-dump would. False means missing/empty/unexpected file.
+    try:
+        f = path.open("r+b")
+    except FileNotFoundError:
+        return False
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= 2:
+            return False
+        f.seek(max(0, size - 64))
+        tail = f.read()
+        body = tail.rstrip()
+        if not body.endswith(b"]"):
+            return False
+        body = body[:-1].rstrip()
+        if not body.endswith(b"\n  }"):  # last element as written by indent=2
+            return False
+        f.seek(size - len(tail) + len(body))
+        f.write(b",\n" + _dumps([entry])[2:-2] + b"\n]")
+        f.truncate()
+    return True
 
 # ---------- Fills input
 def load_fills_csv(path: Path, asset: str):
     rows = []
-    with path.open(newline="") as f:
-        r = csv.DictReader(f)
+    with path.open(newline="", encoding="utf-8") as f:
+        r = csv.reader(f)
         if asset == "equity":
-            req = ("action","ticker","qty","fill_price","currency")
-        else:
-            req = ("action","symbol","amount","fill_price_cad")
-        miss = [c for c in req if c not in r.fieldnames]
-        if miss: die(f"fills CSV missing columns: {miss}")
-
-        for row in r:
-            action = row["action"].strip().lower()
-            if action not in ("buy","sell"): die(f"invalid action: {action}")
-            if asset == "equity":
+            i_act, i_tic, i_qty, i_px, i_cur = _header_index(r, ("action","ticker","qty","fill_price","currency"), "fills")
+            for row in r:
+                if not row: continue
+                action = row[i_act].strip().lower()
+                if action not in ("buy","sell"): raise LedgerError(f"invalid action: {action}")
                 rows.append({
                     "action": action,
-                    "ticker": row["ticker"].strip().upper(),
-                    "qty": D(row["qty"]),
-                    "fill_price": D(row["fill_price"]),
-                    "currency": row["currency"].strip().upper()
+                    "ticker": row[i_tic].strip().upper(),
+                    "qty": D(row[i_qty]),
+                    "fill_price": D(row[i_px]),
+                    "currency": row[i_cur].strip().upper()
                 })
-            else:
+        else:
+            i_act, i_sym, i_amt, i_px = _header_index(r, ("action","symbol","amount","fill_price_cad"), "fills")
+            for row in r:
+                if not row: continue
+                action = row[i_act].strip().lower()
+                if action not in ("buy","sell"): raise LedgerError(f"invalid action: {action}")
                 rows.append({
                     "action": action,
-                    "symbol": row["symbol"].strip().upper(),
-                    "amount": D(row["amount"]),
-                    "fill_price_cad": D(row["fill_price_cad"])
+                    "symbol": row[i_sym].strip().upper(),
+                    "amount": D(row[i_amt]),
+                    "fill_price_cad": D(row[i_px])
                 })
     return rows
 
@@ -147,18 +223,19 @@ def interactive_fills(asset: str):
         line = input("> ").strip()
         if not line: break
         parts = line.split()
+        # tokens are already str: hand them straight to the C Decimal parser
         try:
             if asset == "equity":
                 act, tic, q, p, cur = parts
                 rows.append({
                     "action": act.lower(), "ticker": tic.upper(),
-                    "qty": D(q), "fill_price": D(p), "currency": cur.upper()
+                    "qty": Decimal(q), "fill_price": Decimal(p), "currency": cur.upper()
                 })
             else:
                 act, sym, amt, p = parts
                 rows.append({
                     "action": act.lower(), "symbol": sym.upper(),
-                    "amount": D(amt), "fill_price_cad": D(p)
+                    "amount": Decimal(amt), "fill_price_cad": Decimal(p)
                 })
         except Exception:
             print("Could not parse. Try again.")
@@ -166,131 +243,187 @@ def interactive_fills(asset: str):
     return rows
 
 # ---------- Apply to holdings (weighted avg cost, sells reduce qty)
-def index_by(rows, key): return {r[key]: r for r in rows}
+def index_by(rows, key): return dict(zip(map(itemgetter(key), rows), rows))
 
+# Deliberately per-fill Decimal, even for large backfills: each fill rounds shares
+# and avg_cost before the next one (as apply_trades does), which a float64
+# vectorized pass can't reproduce, and the loop costs ~1.5us/fill.
 def apply_equity(holdings, fills):
     idx = index_by(holdings, "ticker")
+    order = sorted(idx)  # kept sorted as keys come and go, so saving needs no sort
     for f in fills:
         tkr = f["ticker"]; action = f["action"]
-        qty  = D(f["qty"]); price = D(f["fill_price"]); cur = f["currency"]
-        if qty <= 0: die(f"non-positive qty for {tkr}")
+        qty  = f["qty"]; price = f["fill_price"]; cur = f["currency"]  # already Decimal from the loaders
+        assert isinstance(qty, Decimal) and isinstance(price, Decimal)
+        if qty <= 0: raise LedgerError(f"non-positive qty for {tkr}")
         row = idx.get(tkr)
         if action == "buy":
             if row:
-                if row["currency"] != cur: die(f"currency mismatch for {tkr}")
-                new_sh = row["shares"] + qty
-                new_cost = ((row["shares"]*row["avg_cost"]) + (qty*price)) / new_sh
+                if row["currency"] != cur: raise LedgerError(f"currency mismatch for {tkr}")
+                sh = row["shares"]
+                new_sh = sh + qty
+                new_cost = ((sh*row["avg_cost"]) + (qty*price)) / new_sh
                 row["shares"]   = round_qty(new_sh)
                 row["avg_cost"] = round_price(new_cost)
             else:
+                bisect.insort(order, tkr)
                 idx[tkr] = {"ticker": tkr, "shares": round_qty(qty), "avg_cost": round_price(price), "currency": cur}
         else:  # sell
-            if not row: die(f"selling non-existent holding {tkr}")
-            if qty > row["shares"]: die(f"sell qty {qty} exceeds holding {row['shares']} for {tkr}")
-            row["shares"] = round_qty(row["shares"] - qty)
-            if row["shares"] == 0: del idx[tkr]
-    return list(idx.values())
+            if not row: raise LedgerError(f"selling non-existent holding {tkr}")
+            sh = row["shares"]
+            if qty > sh: raise LedgerError(f"sell qty {qty} exceeds holding {sh} for {tkr}")
+            left = round_qty(sh - qty)
+            if left == 0:
+                del idx[tkr]
+                order.remove(tkr)
+            else:
+                row["shares"] = left
+    return [idx[k] for k in order]
 
+# per-fill Decimal on purpose, same as apply_equity above
 def apply_crypto(holdings, fills):
     idx = index_by(holdings, "symbol")
+    order = sorted(idx)  # kept sorted as keys come and go, so saving needs no sort
     for f in fills:
         sym = f["symbol"]; action = f["action"]
-        amt  = D(f["amount"]); price = D(f["fill_price_cad"])
-        if amt <= 0: die(f"non-positive amount for {sym}")
+        amt  = f["amount"]; price = f["fill_price_cad"]
+        assert isinstance(amt, Decimal) and isinstance(price, Decimal)
+        if amt <= 0: raise LedgerError(f"non-positive amount for {sym}")
         row = idx.get(sym)
         if action == "buy":
             if row:
-                new_amt  = row["amount"] + amt
-                new_cost = ((row["amount"]*row["avg_cost_cad"]) + (amt*price)) / new_amt
+                held = row["amount"]
+                new_amt  = held + amt
+                new_cost = ((held*row["avg_cost_cad"]) + (amt*price)) / new_amt
                 row["amount"]       = round_qty(new_amt)
                 row["avg_cost_cad"] = round_price(new_cost)
             else:
+                bisect.insort(order, sym)
                 idx[sym] = {"symbol": sym, "amount": round_qty(amt), "avg_cost_cad": round_price(price)}
         else:  # sell
-            if not row: die(f"selling non-existent holding {sym}")
-            if amt > row["amount"]: die(f"sell amount {amt} exceeds holding {row['amount']} for {sym}")
-            row["amount"] = round_qty(row["amount"] - amt)
-            if row["amount"] == 0: del idx[sym]
-    return list(idx.values())
+            if not row: raise LedgerError(f"selling non-existent holding {sym}")
+            held = row["amount"]
+            if amt > held: raise LedgerError(f"sell amount {amt} exceeds holding {held} for {sym}")
+            left = round_qty(held - amt)
+            if left == 0:
+                del idx[sym]
+                order.remove(sym)
+            else:
+                row["amount"] = left
+    return [idx[k] for k in order]
 
 # ---------- Convert fills -> site entry trades
+def week_entry(week: str, deposit: float, fills, asset: str, notes: str = ""):
+    entry = {
+        "week_start": week,
+        "deposit_cad": round(float(deposit), 2),
+        "trades": fills_to_entry_trades(fills, asset),
+    }
+    if notes:
+        entry["notes"] = notes
+    return entry
+
 def fills_to_entry_trades(fills, asset: str):
-    out = []
     if asset == "equity":
-        for f in fills:
-            out.append({
-                "action": f["action"],
-                "ticker": f["ticker"],
-                "qty": float(f["qty"]),
-                "price": float(f["fill_price"]),
-                "currency": f["currency"]
-            })
-    else:
-        for f in fills:
-            out.append({
-                "action": f["action"],
-                "symbol": f["symbol"],
-                "qty": float(f["amount"]),
-                "price": float(f["fill_price_cad"])
-            })
-    return out
+        return [{
+            "action": f["action"],
+            "ticker": f["ticker"],
+            "qty": float(f["qty"]),
+            "price": float(f["fill_price"]),
+            "currency": f["currency"]
+        } for f in fills]
+    return [{
+        "action": f["action"],
+        "symbol": f["symbol"],
+        "qty": float(f["amount"]),
+        "price": float(f["fill_price_cad"])
+    } for f in fills]
+
+def process_book(asset: str, holds_path: Path, entries_path: Path, fills_path,
+                 week: str, deposit: float, notes: str = ""):
+    """Apply one week's fills to a book and append its entry; fills_path=None prompts."""
+    deposit = float(deposit)
+
+    # Load existing holdings; saved when the block exits without an error
+    with _open_holdings(holds_path, asset) as holdings:
+        # Fills
+        if fills_path:
+            fills = load_fills_csv(fills_path, asset)
+        else:
+            fills = interactive_fills(asset)
+
+        if not fills:
+            print("No fills entered. You can still log a deposit-only week.")
+        else:
+            # Normalize action
+            for f in fills:
+                if f["action"] not in ("buy","sell"): raise LedgerError("invalid action in fills")
+
+        # Apply to holdings
+        if asset == "equity":
+            holdings[:] = apply_equity(holdings, fills)
+        else:
+            holdings[:] = apply_crypto(holdings, fills)
+
+    # Append entry for your site
+    append_entry(entries_path, week_entry(week, deposit, fills, asset, notes))
+
+    print(f"Updated holdings → {holds_path}")
+    print(f"Appended weekly entry → {entries_path}")
+
+def process_many(asset: str, holds_path: Path, entries_path: Path, weeks, deposit: float, notes: str = ""):
+    """process_book over (week, fills_path) pairs in order, writing each file once at the end."""
+    entries = load_entries(entries_path)
+    apply = apply_equity if asset == "equity" else apply_crypto
+    with _open_holdings(holds_path, asset) as holdings:
+        for week, fills_path in weeks:
+            fills = load_fills_csv(fills_path, asset)
+            holdings[:] = apply(holdings, fills)
+            entries.append(week_entry(week, deposit, fills, asset, notes))
+
+    ensure_parent(entries_path)
+    write_entries(entries_path, entries)
+
+    print(f"Updated holdings → {holds_path}")
+    print(f"Appended {len(weeks)} weekly entries → {entries_path}")
+
+def batch_weeks(fills_dir: Path):
+    """(week, path) for every <YYYY-MM-DD>*.csv in fills_dir, oldest first."""
+    weeks = []
+    for p in sorted(fills_dir.glob("*.csv")):
+        try:
+            week = date.fromisoformat(p.name[:10]).isoformat()
+        except ValueError:
+            raise LedgerError(f"batch fills file not named by week (YYYY-MM-DD...csv): {p.name}")
+        weeks.append((week, p))
+    if not weeks:
+        raise LedgerError(f"no fills CSVs in {fills_dir}")
+    return weeks
 
 def main():
     ap = argparse.ArgumentParser(description="Record weekly trades and update holdings + entries JSON")
     ap.add_argument("--asset", required=True, choices=["equity","crypto"], help="Which book to update")
-    ap.add_argument("--week", required=True, help="ISO date (Sunday), e.g., 2025-09-07")
+    ap.add_argument("--week", help="ISO date (Sunday), e.g., 2025-09-07")
     ap.add_argument("--deposit", type=float, default=0.0, help="Weekly contribution (CAD)")
     ap.add_argument("--fills", type=str, default=None, help="CSV of executed fills (see README for schemas). If omitted, interactive mode.")
+    ap.add_argument("--batch-fills", type=str, default=None, help="Directory of weekly fills CSVs named YYYY-MM-DD*.csv; records every week in one pass (--deposit/--notes apply to each)")
     ap.add_argument("--holdings", type=str, required=True, help="Path to holdings CSV to update/create")
     ap.add_argument("--entries", type=str, required=True, help="Path to entries.json (site data) to append")
     ap.add_argument("--notes", type=str, default="", help="Optional note for this week")
     args = ap.parse_args()
+    if not args.batch_fills and not args.week:
+        ap.error("--week is required unless --batch-fills is given")
 
-    asset = args.asset
-    week  = args.week
-    deposit = float(args.deposit)
-
-    holds_path = Path(args.holdings)
-    entries_path = Path(args.entries)
-
-    # Load existing holdings
-    holdings = load_holdings(holds_path, asset)
-
-    # Fills
-    if args.fills:
-        fills = load_fills_csv(Path(args.fills), asset)
-    else:
-        fills = interactive_fills(asset)
-
-    if not fills:
-        print("No fills entered. You can still log a deposit-only week.")
-    else:
-        # Normalize action
-        for f in fills:
-            if f["action"] not in ("buy","sell"): die("invalid action in fills")
-
-    # Apply to holdings
-    if asset == "equity":
-        updated = apply_equity(holdings, fills)
-    else:
-        updated = apply_crypto(holdings, fills)
-
-    # Save holdings
-    write_holdings(holds_path, updated, asset)
-
-    # Append entry for your site
-    entry = {
-        "week_start": week,
-        "deposit_cad": round(float(deposit), 2),
-        "trades": fills_to_entry_trades(fills, asset),
-    }
-    if args.notes:
-        entry["notes"] = args.notes
-
-    append_entry(entries_path, entry)
-
-    print(f"Updated holdings → {holds_path}")
-    print(f"Appended weekly entry → {entries_path}")
+    try:
+        if args.batch_fills:
+            process_many(args.asset, Path(args.holdings), Path(args.entries),
+                         batch_weeks(Path(args.batch_fills)), args.deposit, args.notes)
+        else:
+            process_book(args.asset, Path(args.holdings), Path(args.entries),
+                         Path(args.fills) if args.fills else None,
+                         args.week, args.deposit, args.notes)
+    except LedgerError as e:
+        die(str(e))
 
 if __name__ == "__main__":
     main()
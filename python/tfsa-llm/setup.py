@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Build the optional compiled apply loop used by apply_trades.py:
+  python3 setup.py build_ext --inplace
+"""
+
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+setup(
+    name="trade_apply",
+    ext_modules=cythonize(
+        [Extension("trade_apply", ["trade_apply.pyx"], extra_compile_args=["-O3"])],
+        language_level=3,
+    ),
+)
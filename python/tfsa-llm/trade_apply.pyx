@@ -0,0 +1,179 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled twin of apply_trades.apply_equity / apply_crypto.
+
+Works on the same scaled-int rows (shares/amount at 1e6, avg costs at 1e4, fill
+prices as price_n / 10**price_dp) and returns the same sorted list of holding dicts.
+Fill prices finer than 4 dp take an exact Python-int path, since their notional
+can outgrow 64 bits. Errors are raised as ValueError;
+apply_trades.py turns them into die().
+
+Build in place:
+  python3 setup.py build_ext --inplace
+"""
+
+from bisect import insort
+
+# no cdivision: a zero divisor must raise ZeroDivisionError, not trap (SIGFPE)
+cdef inline long long half_up(long long n, long long d):
+    cdef long long q = (2 * (n if n >= 0 else -n) + d) // (2 * d)
+    return q if n >= 0 else -q
+
+cdef object half_up_wide(object n, object d):
+    q = (2 * abs(n) + d) // (2 * d)
+    return q if n >= 0 else -q
+
+cdef str fmt_e6(long long n):
+    sign = "-" if n < 0 else ""
+    if n < 0:
+        n = -n
+    return f"{sign}{n // 1000000}.{n % 1000000:06d}"
+
+def apply_equity_c(list holdings, list trades, list fills):
+    cdef dict hidx = {r["ticker"]: r for r in holdings}
+    cdef list order = sorted(hidx)
+    cdef dict fidx = {}
+    cdef dict t, f, row
+    cdef list fills_here
+    cdef long long qty, fq, total_qty, fill_cost, shares, new_sh
+    cdef object px_dp, up, wide_cost
+
+    for f in fills:
+        fidx.setdefault((f["action"], f["ticker"]), []).append(f)
+
+    for t in trades:
+        action = t["action"]; ticker = t["ticker"]; qty = t["qty_e6"]
+        fills_here = fidx.get((action, ticker))
+        if not fills_here:
+            raise ValueError(f"no fill provided for trade {action} {ticker}")
+
+        total_qty = 0; fill_cost = 0; px_dp = 4
+        if action == "buy":
+            for f in fills_here:
+                if f["price_dp"] > px_dp:
+                    px_dp = f["price_dp"]
+            if px_dp == 4:
+                for f in fills_here:
+                    fq = f["qty_e6"]
+                    total_qty += fq
+                    fill_cost += fq * <long long>f["price_n"]
+            else:
+                up = 10 ** (px_dp - 4)
+                wide_cost = 0
+                for f in fills_here:
+                    fq = f["qty_e6"]
+                    total_qty += fq
+                    wide_cost += fq * f["price_n"] * 10 ** (px_dp - f["price_dp"])
+        else:
+            for f in fills_here:
+                total_qty += <long long>f["qty_e6"]
+        if total_qty != qty:
+            raise ValueError(f"fills qty {fmt_e6(total_qty)} != trade qty {fmt_e6(qty)} for {ticker}")
+
+        row = hidx.get(ticker)
+        if action == "buy":
+            if row is not None:
+                cur = row["currency"]
+                for f in fills_here:
+                    if f["currency"] != cur:
+                        raise ValueError(f"currency mismatch for {ticker}")
+                shares = row["shares_e6"]
+                new_sh = shares + qty
+                if px_dp == 4:
+                    row["cost_e4"] = half_up(shares * <long long>row["cost_e4"] + fill_cost, new_sh)
+                else:
+                    row["cost_e4"] = half_up_wide(shares * row["cost_e4"] * up + wide_cost, new_sh * up)
+                row["shares_e6"] = new_sh
+            else:
+                insort(order, ticker)
+                hidx[ticker] = {
+                    "ticker": ticker,
+                    "shares_e6": qty,
+                    "cost_e4": half_up(fill_cost, qty) if px_dp == 4 else half_up_wide(wide_cost, qty * up),
+                    "currency": fills_here[0]["currency"]
+                }
+        else:  # sell
+            if row is None:
+                raise ValueError(f"selling non-existent holding {ticker}")
+            shares = row["shares_e6"]
+            if qty > shares:
+                raise ValueError(f"sell qty {fmt_e6(qty)} exceeds holding {fmt_e6(shares)} for {ticker}")
+            if shares == qty:
+                del hidx[ticker]
+                order.remove(ticker)
+            else:
+                row["shares_e6"] = shares - qty
+
+    return [hidx[k] for k in order]
+
+def apply_crypto_c(list holdings, list trades, list fills):
+    cdef dict hidx = {r["symbol"]: r for r in holdings}
+    cdef list order = sorted(hidx)
+    cdef dict fidx = {}
+    cdef dict t, f, row
+    cdef list fills_here
+    cdef long long amt, fa, total_amt, fill_cost, amount, new_amt
+    cdef object px_dp, up, wide_cost
+
+    for f in fills:
+        fidx.setdefault((f["action"], f["symbol"]), []).append(f)
+
+    for t in trades:
+        action = t["action"]; symbol = t["symbol"]; amt = t["qty_e6"]
+        fills_here = fidx.get((action, symbol))
+        if not fills_here:
+            raise ValueError(f"no fill provided for trade {action} {symbol}")
+
+        total_amt = 0; fill_cost = 0; px_dp = 4
+        if action == "buy":
+            for f in fills_here:
+                if f["price_dp"] > px_dp:
+                    px_dp = f["price_dp"]
+            if px_dp == 4:
+                for f in fills_here:
+                    fa = f["amount_e6"]
+                    total_amt += fa
+                    fill_cost += fa * <long long>f["price_n"]
+            else:
+                up = 10 ** (px_dp - 4)
+                wide_cost = 0
+                for f in fills_here:
+                    fa = f["amount_e6"]
+                    total_amt += fa
+                    wide_cost += fa * f["price_n"] * 10 ** (px_dp - f["price_dp"])
+        else:
+            for f in fills_here:
+                total_amt += <long long>f["amount_e6"]
+        if total_amt != amt:
+            raise ValueError(f"fills amount {fmt_e6(total_amt)} != trade qty {fmt_e6(amt)} for {symbol}")
+
+        row = hidx.get(symbol)
+        if action == "buy":
+            if row is not None:
+                amount = row["amount_e6"]
+                new_amt = amount + amt
+                if px_dp == 4:
+                    row["cost_e4"] = half_up(amount * <long long>row["cost_e4"] + fill_cost, new_amt)
+                else:
+                    row["cost_e4"] = half_up_wide(amount * row["cost_e4"] * up + wide_cost, new_amt * up)
+                row["amount_e6"] = new_amt
+            else:
+                insort(order, symbol)
+                hidx[symbol] = {
+                    "symbol": symbol,
+                    "amount_e6": amt,
+                    "cost_e4": half_up(fill_cost, amt) if px_dp == 4 else half_up_wide(wide_cost, amt * up)
+                }
+        else:  # sell
+            if row is None:
+                raise ValueError(f"selling non-existent holding {symbol}")
+            amount = row["amount_e6"]
+            if amt > amount:
+                raise ValueError(f"sell amount {fmt_e6(amt)} exceeds holding {fmt_e6(amount)} for {symbol}")
+            if amount == amt:
+                del hidx[symbol]
+                order.remove(symbol)
+            else:
+                row["amount_e6"] = amount - amt
+
+    return [hidx[k] for k in order]